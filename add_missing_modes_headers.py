@@ -12,37 +12,7 @@ To run the code:
 Author: gdaron
 '''
 
-import sys, os
-import os.path as path
-import fileinput
-
-src_extensions = ['.txt']
-
-def is_src_file(f):
-    results = [f.endswith(ext) for ext in src_extensions]
-    return True in results
-
-def is_header_missing(f):
-    with open(f) as reader:
-        lines = reader.read().lstrip().splitlines()
-        #if len(lines) > 0: return not lines[0].startswith("/**")
-        if len(lines) > 0: return not lines[0].startswith("AIRCRAFT")
-        if len(lines) == 0: return True
-        return True
-
-def get_src_files(dirname):
-    src_files = []
-    for cur, _dirs, files in os.walk(dirname):
-        [src_files.append(path.join(cur,f)) for f in files if is_src_file(f)]
-
-    return [f for f in src_files if is_header_missing(f)]
-
-def add_headers(files, header):
-    for line in fileinput.input(files, inplace=True):
-        if fileinput.isfirstline():
-            [ print(h) for h in header.splitlines() ]
-        print(line, end="")
-
+from fix_metdb_headers import fix_headers # shared tool for AMDARS and MODE-S (see fix_metdb_headers.py)
 
 
 if __name__ == "__main__":
@@ -72,28 +42,4 @@ if __name__ == "__main__":
 
     	root_path = '/data/users/gdaron/Mode-S_altitude/MetDB_extract/MODE-S/{0}'.format(airport)
 
-    	header = "AIRCRAFT_NO,TIME,LAT,LON,PESR_ALTD,GNSS_ALTD" 
-    	files = get_src_files(root_path)
-
-    	print("Files with missing headers:")
-    	[print("  - %s" % f) for f in files]
-
-    	print()
-    	print("Header: ")
-    	print(header)
-'''
-    	for f in files:
-    		filesize = os.path.getsize(f)
-    		if filesize == 0:
-    			print(f)
-    			with open(f, 'a') as file_writer:
-    				file_writer.write(header + "\n")
-    				file_writer.close
-
-    	files = get_src_files(root_path)
-
-    	if len(files)!= 0:
-    		add_headers(files, header)
-
-'''
-
+    	files = fix_headers(root_path, 'MODE-S', fix=False) # list only (set fix=True to add the headers)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+altitude_stats.py
+
+Shared functions for summarising AMDAR and Mode-S altitudes (daily minimums/extremes)
+
+Usage (from another script):
+   from altitude_stats import daily_minimum, daily_extremes, stream_daily_minimum
+'''
+
+import pandas as pd
+
+from metdb_io import iter_metdb_chunks, metdb_filename, concat_metdb_frames
+
+
+#-----------------------------------------------
+# Function for finding the rows with the lowest (or highest) altitude on each day
+# One groupby pass over any number of days/airports - df is indexed by TIME (as returned by import_metdb_file)
+# column is e.g. 'ALTD', 'PESR_ALTD' or 'GNSS_ALTD', n > 1 returns the n lowest (highest) observations per day,
+# by adds extra grouping columns (e.g. an airport column)
+# Returns the selected rows indexed by day (TIME at 00:00), ties are resolved by keeping the first row in file order
+#-----------------------------------------------
+
+def daily_extremes(df, column, n=1, by=None, lowest=True):
+
+    by_cols = [] if by is None else ([by] if isinstance(by, str) else list(by))
+
+    data = df.reset_index()
+    data = data[data[column].notna()] # days without any valid altitude have no minimum
+    data = data.assign(DAY=data['TIME'].dt.normalize())
+
+    if n == 1:
+        grouped = data.groupby(['DAY'] + by_cols, sort=True)[column]
+        idx = grouped.idxmin() if lowest else grouped.idxmax() # first occurrence of the extreme value
+        day_extremes = data.loc[idx.to_numpy()]
+    else:
+        data = data.sort_values(by=['DAY', column], ascending=[True, lowest], kind='mergesort') # stable, so ties stay in file order
+        day_extremes = data.groupby(['DAY'] + by_cols, sort=False).head(n)
+
+    day_extremes = day_extremes.drop(columns='TIME').rename(columns={'DAY': 'TIME'}).set_index('TIME')
+
+    return(day_extremes)
+
+
+#-----------------------------------------------
+# Function for finding the row(s) containing the daily minimum altitude
+#-----------------------------------------------
+
+def daily_minimum(df, column, n_lowest=1, by=None):
+
+    day_min = daily_extremes(df, column, n_lowest, by, lowest=True)
+
+    return(day_min)
+
+
+#-----------------------------------------------
+# Functions for the streaming mode: running daily minimum and daily summary (count/sum/min/max) accumulators,
+# updated one chunk of rows at a time, so only one row (and one set of counters) per day is kept in memory
+# Rows are offered in file order, so ties resolve to the same row as daily_minimum on all the data at once
+# by (as in daily_minimum) groups both the daily mins and the summary by extra columns (e.g. an airport column)
+#-----------------------------------------------
+
+def new_daily_accumulator(column, by=None):
+
+    accumulator = {'column': column,
+                   'by': by,
+                   'n_rows': 0,
+                   'day_min': None,
+                   'summary': None}
+
+    return(accumulator)
+
+
+def update_daily_accumulator(accumulator, df):
+
+    if len(df) == 0:
+        return
+
+    column = accumulator['column']
+    accumulator['n_rows'] += len(df)
+
+    day_min = daily_minimum(df, column, by=accumulator['by'])
+    if accumulator['day_min'] is not None:
+        day_min = daily_minimum(concat_metdb_frames([accumulator['day_min'], day_min]), column, by=accumulator['by']) # earlier rows first
+    accumulator['day_min'] = day_min
+
+    by = accumulator['by']
+    by_cols = [] if by is None else ([by] if isinstance(by, str) else list(by))
+
+    values = pd.DataFrame({'TIME': df.index.normalize(), **{by_col: df[by_col].to_numpy() for by_col in by_cols}, column: df[column].astype(float).to_numpy()})
+    summary = values.groupby(['TIME'] + by_cols, sort=True)[column].agg(['count', 'sum', 'min', 'max'])
+    if accumulator['summary'] is not None:
+        summary = pd.concat([accumulator['summary'], summary]).groupby(level=list(range(summary.index.nlevels))).agg({'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'})
+    accumulator['summary'] = summary
+
+
+def daily_accumulator_results(accumulator):
+
+    day_min = accumulator['day_min']
+    summary = accumulator['summary']
+
+    if day_min is None: # no rows were offered
+        return(None, None)
+
+    summary = summary.assign(mean=summary['sum'] / summary['count']) # indexed by day (and the by columns)
+
+    return(day_min, summary)
+
+
+#-----------------------------------------------
+# Function for streaming the extracts of one airport through the accumulators (AMDARS or MODE-S, chunksize rows at a time)
+# Returns the daily minimum rows, the daily summary and (only if keep_rows is True) all the rows read
+#-----------------------------------------------
+
+def stream_daily_minimum(file_path, data_type, airport, date_list, column, chunksize=200000, keep_rows=False):
+
+    accumulator = new_daily_accumulator(column)
+    rows = [] if keep_rows else None
+
+    for date in date_list:
+        for chunk in iter_metdb_chunks(metdb_filename(file_path, data_type, airport, date), data_type, chunksize):
+            update_daily_accumulator(accumulator, chunk)
+            if keep_rows:
+                rows.append(chunk)
+
+    day_min, summary = daily_accumulator_results(accumulator)
+
+    if keep_rows:
+        rows = concat_metdb_frames(rows) if len(rows) > 0 else None
+
+    return(day_min, summary, rows)
@@ -20,7 +20,9 @@ import matplotlib.pyplot as plt
 from matplotlib import dates
 import datetime
 from datetime import timedelta
-import pyproj
+
+from geo_tools import build_airport_index, find_nearest_airports
+from runway_tools import build_runway_index
 
 #-----------------------------------------------
 # Import aircraft ascent and descent profiles
@@ -70,33 +72,6 @@ def import_runway_info(file_path_info):
 
     return(data)
 
-#-----------------------------------------------
-# Find nearest airport (This is very slow!)
-#-----------------------------------------------
-
-def find_nearest_airport(airport_info_df, airport_lat_col, airport_lon_col, lat2, lon2):
-
-    geodesic = pyproj.Geod(ellps='WGS84')
-
-    list = []
-    		
-    for i, row in airport_info_df.iterrows():
-    	lon1 = row[airport_lon_col]
-    	lat1 = row[airport_lat_col]
-
-    	fwd_azimuth,back_azimuth,distance = geodesic.inv(lon1, lat1, lon2, lat2)
-    	list.append(distance)
-    		
-    airport_info_df['distance'] = list
-  
-    airport_nearest = airport_info_df[airport_info_df.distance == airport_info_df.distance.min()]
-    print('Nearest airport is: '+airport_nearest['name'])
-    to_list = airport_nearest['ident'].tolist()
-    airport_id = to_list[0]
-    
-    return(airport_id)
-
-
 #-----------------------------------------------
 # MAIN CODE
 #-----------------------------------------------
@@ -155,6 +130,9 @@ def main():
     airport_info = import_airport_info(file_path_info)
     runway_info = import_runway_info(file_path_info)
 
+    airport_index = build_airport_index(airport_info, 'latitude_deg', 'longitude_deg') # spatial index of airports (built once)
+    runway_index = build_runway_index(runway_info) # runways by airport ident (built once)
+
     #---------------------------------------------------------------------    
     # 04. Loop through airports/dates and compare orientations with runway orientation of nearest airport
     #---------------------------------------------------------------------
@@ -177,12 +155,12 @@ def main():
     				lat2 = data_amdar.loc[len(data_amdar)-1,'LAT' ]
     				lon2 = data_amdar.loc[len(data_amdar)-1,'LON' ]
 
-    			airport_id = find_nearest_airport(airport_info, 'latitude_deg', 'longitude_deg', lat2, lon2)
+    			airport_nearest = find_nearest_airports(airport_index, lat2, lon2)
+    			print('Nearest airport is: {0}'.format(airport_nearest.loc[0, 'name']))
+    			airport_id = airport_nearest.loc[0, 'ident']
 
-    			#search for runway orientation of airport id
-    			out = runway_info.loc[runway_info['airport_ident'] == airport_id]
-    			out.reset_index(inplace=True)
-    			runway_orient = out.loc[0, 'le_heading_degT'] # choose first if more than one
+    			#search for runway orientation of airport id (runway index is built once, in step 03)
+    			runway_orient = runway_index['runways'][airport_id]['le_heading'][0] # choose first if more than one
     			data_amdar['runway_orientation'] = runway_orient
     			data_amdar['difference'] = data_amdar['runway_orientation'] - data_amdar['orientation']
     			print(data_amdar)
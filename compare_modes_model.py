@@ -13,14 +13,23 @@ Author: gdaron
 '''
 
 import csv
+import logging
 import pandas as pd
 import numpy as np
 import os
-import matplotlib.pyplot as plt
-from matplotlib import dates
 import datetime
 from datetime import timedelta
 import netCDF4 as nc
+from collections import OrderedDict
+
+from geo_tools import convert_to_british_grid
+from altitude_stats import daily_minimum
+from observation_store import query_observations, store_filename
+from incremental import load_manifest, save_manifest, result_signature, is_up_to_date, load_result, save_result
+from plotting import timeseries_spec, render_figures
+from run_report import new_run_report, timed_stage, add_stage, write_run_report, setup_logging
+
+logger = logging.getLogger('compare_modes_model')
 
 
 
@@ -40,6 +49,27 @@ def load_day_min(file_path_day_min, airport, period):
     return(data)
 
 
+#-----------------------------------------------
+# Function for finding the daily mins of an airport directly from the observation store (instead of the
+# *_day_min_BG.csv files written by convert_day_min_bng.py) - same rows and British Grid LAT/LON
+#-----------------------------------------------
+
+def load_store_day_min(store_path, airport, start_date, end_date):
+
+    data = query_observations(store_path, 'MODE-S', [airport], start_date.strftime('%Y%m%d'), end_date.strftime('%Y%m%d'))
+
+    if type(data) == int:
+        return -1
+
+    data = daily_minimum(data, 'GNSS_ALTD')
+
+    easting, northing = convert_to_british_grid(data['LAT'], data['LON']) # LAT/LON columns hold northing/easting
+    data['LAT'] = np.round(northing, 2)
+    data['LON'] = np.round(easting, 2)
+
+    return(data)
+
+
 def load_netcdf(file_path_netcdf, scenario):
 
     filename = '{0}/constant_ng_network_{1}_deriv.nc'.format(file_path_netcdf, scenario) 
@@ -52,24 +82,92 @@ def load_netcdf(file_path_netcdf, scenario):
     return(data)
 
 
-def extract_model_data(netcdf_file, point_lon, point_lat, xcellsize, ycellsize):
+#-----------------------------------------------
+# Functions for the model grid store: the netCDF files of all scenarios are opened once (lazily - only the
+# grid axes are read), and lowest_beam_height is read in square chunks of chunk_size cells, stacked over the
+# scenarios into (scenario, y, x) blocks. Only the chunks containing requested points are read, and the most
+# recently used max_chunks blocks are kept in memory
+#-----------------------------------------------
+
+def load_model_grid(file_path_netcdf, scenario_list, chunk_size=128, max_chunks=64):
+
+    datasets = [load_netcdf(file_path_netcdf, scenario) for scenario in scenario_list]
+
+    lat = datasets[0].variables['latitude'][:] # grid axes (British Grid, m) - the same for all scenarios
+    lon = datasets[0].variables['longitude'][:]
+
+    model_grid = {'scenarios': scenario_list,
+                  'min_lat': np.amin(lat),
+                  'min_lon': np.amin(lon),
+                  'nrows': lat.size,
+                  'ncols': lon.size,
+                  'datasets': datasets,
+                  'chunk_size': chunk_size,
+                  'max_chunks': max_chunks,
+                  'chunks': OrderedDict()} # (chunk row, chunk column) -> (scenario, y, x) block
+
+    return(model_grid)
+
+
+def close_model_grid(model_grid):
+
+    for ds in model_grid['datasets']:
+        ds.close()
+
+    model_grid['chunks'].clear()
+
+
+def read_model_chunk(model_grid, chunk):
 
-    lat = netcdf_file.variables['latitude'][:]
-    nrows = lat.size
-    min_lat = np.amin(lat)
-    max_lat = np.amax(lat)
+    chunks = model_grid['chunks']
 
-    lon = netcdf_file.variables['longitude'][:]
-    ncols = lon.size
-    min_lon = np.amin(lon)
-    max_lon = np.amax(lon)
+    if chunk in chunks:
+        chunks.move_to_end(chunk)
+        return(chunks[chunk])
 
-    px = int((point_lon - min_lon) / xcellsize)
-    py = int((point_lat - min_lat) / ycellsize)
+    size = model_grid['chunk_size']
+    y0, x0 = chunk[0] * size, chunk[1] * size
+    window = (slice(y0, min(y0 + size, model_grid['nrows'])), slice(x0, min(x0 + size, model_grid['ncols'])))
 
-    lowest_beam_height = netcdf_file.variables['lowest_beam_height_amsl'][:]
+    block = np.stack([np.ma.filled(ds.variables['lowest_beam_height_amsl'][window].astype(float), np.nan) for ds in model_grid['datasets']])
 
-    return lowest_beam_height, px, py
+    chunks[chunk] = block
+    if len(chunks) > model_grid['max_chunks']:
+        chunks.popitem(last=False) # least recently used
+
+    return(block)
+
+
+#-----------------------------------------------
+# Function for extracting the model data at many points for all scenarios (one read per chunk touched)
+# Picks the cell to the west/south of each point, returns an array of shape (points, scenarios)
+#-----------------------------------------------
+
+def extract_model_data(model_grid, point_lon, point_lat, xcellsize, ycellsize):
+
+    px = np.floor((np.asarray(point_lon, dtype=float) - model_grid['min_lon']) / xcellsize)
+    py = np.floor((np.asarray(point_lat, dtype=float) - model_grid['min_lat']) / ycellsize)
+
+    inside = (px >= 0) & (px < model_grid['ncols']) & (py >= 0) & (py < model_grid['nrows']) # NaN for points outside the grid
+
+    px = px[inside].astype(int)
+    py = py[inside].astype(int)
+
+    lowest_beam_height = np.full((len(inside), len(model_grid['scenarios'])), np.nan)
+
+    size = model_grid['chunk_size']
+    chunk_ids = (py // size) * (model_grid['ncols'] // size + 1) + px // size
+    values = np.empty((len(px), len(model_grid['scenarios'])))
+
+    for chunk_id in np.unique(chunk_ids):
+        in_chunk = chunk_ids == chunk_id
+        chunk_py, chunk_px = py[in_chunk], px[in_chunk]
+        block = read_model_chunk(model_grid, (chunk_py[0] // size, chunk_px[0] // size))
+        values[in_chunk] = block[:, chunk_py % size, chunk_px % size].T
+
+    lowest_beam_height[inside] = values
+
+    return(lowest_beam_height)
 
 
 def main():
@@ -83,11 +181,15 @@ def main():
     if not os.path.exists(out_path):
         os.makedirs(out_path)
 
+    store_path = None # observation store built by observation_store.py - if set, the daily mins are found from the store rather than the BG csv files
 
-    # 2. Load NETCDF files
-    ds_exist = load_netcdf(file_path_netcdf, 'Existing')
-    ds_priority = load_netcdf(file_path_netcdf, 'Priority')
-    ds_all = load_netcdf(file_path_netcdf, 'AllSites')
+    incremental_path = out_path+'/incremental' # model values are reused while the input files are unchanged (set to None to always recompute)
+
+
+    # 2. NETCDF files (grids for all networks are read once, when first needed)
+    scenario_list = ['Existing', 'Priority', 'AllSites']
+    netcdf_files = ['{0}/constant_ng_network_{1}_deriv.nc'.format(file_path_netcdf, scenario) for scenario in scenario_list]
+    model_grid = None
 
 
     # 3. Select period
@@ -101,6 +203,8 @@ def main():
         start_date = datetime.date(2022,1,1)
         end_date = datetime.date(2022,1,31)
 
+    date_list = [(start_date + timedelta(days=i)).strftime('%Y%m%d') for i in range((end_date - start_date).days + 1)]
+
     
     # 4. Select airports
     #airport_name_list = ['Aberdeen']
@@ -122,66 +226,94 @@ def main():
                          'Liverpool',\
                          'Cardiff']
     
-    stats_df = pd.DataFrame() # empty dataframe for stats
+    make_plots = True # False for compute-only runs (no figures are drawn)
+    n_plot_workers = 4 # number of processes used for drawing the figures
 
-    # 5. Loop through airports, extract model data and plot
-    for airport in airport_name_list:
+    log_level = 'INFO' # 'DEBUG' to log the daily mins of every airport, 'WARNING' for errors/warnings only
 
-    	data_day_min = load_day_min(file_path_day_min, airport, period)
+    setup_logging(log_level)
 
-    	for idx, row in data_day_min.iterrows():
-    		point_lat = row['LAT']
-    		point_lon = row['LON']
+    report = new_run_report('compare_modes_model', {'period': period, 'scenarios': scenario_list, 'airports': airport_name_list})
 
-    		# Existing network
-    		lowest_beam_height_exist, px, py = extract_model_data(ds_exist, point_lon, point_lat, 1000, 1000)
-    		data_day_min.loc[idx,'min_obs_altd_exist'] = lowest_beam_height_exist[py, px]
+    stats_list = [] # means for each airport (combined into the stats dataframe at the end)
+    figure_specs = [] # plot of each airport
 
-    		# Priority network
-    		lowest_beam_height_priority, px, py = extract_model_data(ds_priority, point_lon, point_lat, 1000, 1000)
-    		data_day_min.loc[idx,'min_obs_altd_priority'] = lowest_beam_height_priority[py, px]
+    if incremental_path is not None:
+    	manifest = load_manifest(incremental_path)
+    	params = {'scenarios': scenario_list, 'xcellsize': 1000, 'ycellsize': 1000}
 
-    		# AllSites network
-    		lowest_beam_height_all, px, py = extract_model_data(ds_all, point_lon, point_lat, 1000, 1000)
-    		data_day_min.loc[idx,'min_obs_altd_all'] = lowest_beam_height_all[py, px]
+    # 5. Loop through airports, extract model data and plot
+    for airport in airport_name_list:
 
-    	print(data_day_min)
+    	# Incremental mode: reuse the model values if the daily mins and netCDF files are unchanged
+    	up_to_date = False
+    	if incremental_path is not None:
+    		key = '{0}_{1}'.format(airport, period)
+    		if store_path is not None:
+    			input_files = [store_filename(store_path, 'MODE-S', airport, date) for date in date_list] + netcdf_files
+    		else:
+    			input_files = ['{0}/{1}_{2}_day_min_BG.csv'.format(file_path_day_min, airport, period)] + netcdf_files
+    		signature = result_signature(manifest, input_files, params)
+    		up_to_date = is_up_to_date(manifest, incremental_path, key, signature)
+
+    	if up_to_date:
+    		data_day_min = load_result(incremental_path, key)
+    		add_stage(report, 'incremental', results_reused=1)
+
+    	else:
+    		with timed_stage(report, 'load', files_read=1):
+    			if store_path is not None:
+    				data_day_min = load_store_day_min(store_path, airport, start_date, end_date)
+    			else:
+    				data_day_min = load_day_min(file_path_day_min, airport, period)
+    		add_stage(report, 'load', rows_out=len(data_day_min))
+
+    		if model_grid is None:
+    			with timed_stage(report, 'load_model_grid', files_read=len(scenario_list)):
+    				model_grid = load_model_grid(file_path_netcdf, scenario_list)
+
+    		# Existing, Priority and AllSites networks at all daily minimum locations
+    		with timed_stage(report, 'extract_model_data', rows_in=len(data_day_min)):
+    			lowest_beam_height = extract_model_data(model_grid, data_day_min['LON'], data_day_min['LAT'], 1000, 1000)
+
+    		data_day_min['min_obs_altd_exist'] = lowest_beam_height[:, 0]
+    		data_day_min['min_obs_altd_priority'] = lowest_beam_height[:, 1]
+    		data_day_min['min_obs_altd_all'] = lowest_beam_height[:, 2]
+
+    		if incremental_path is not None:
+    			save_result(manifest, incremental_path, key, signature, data_day_min)
+    			save_manifest(manifest, incremental_path)
+
+    	logger.debug('Daily mins for %s:\n%s', airport, data_day_min)
 
     	means = data_day_min[['GNSS_ALTD','min_obs_altd_exist','min_obs_altd_priority','min_obs_altd_all']].mean()
-    	stats_df = pd.concat([stats_df, means], axis=1)
-
-    	# Plot data (multiple days)
-    	start_date_reformat = start_date.strftime('%d/%m/%Y')
-    	end_date_reformat = end_date.strftime('%d/%m/%Y')
-
-    	fig1, ax1 = plt.subplots(figsize=(6,6))
+    	stats_list.append(means)
 
-    	plt.plot(data_day_min['GNSS_ALTD'], marker='.', markersize=3, color ='#1f77b4', linestyle='-', label='Mode-S observed daily minimum', zorder=4)
-    	plt.plot(data_day_min['min_obs_altd_exist'], marker='.', markersize=3, color='#ff7f0e', linestyle='-', label='Model (existing network)', zorder=3)
-    	plt.plot(data_day_min['min_obs_altd_priority'], marker='.', markersize=3, color='#2ca02c', linestyle='-', label='Model (priority network)', zorder=2)
-    	plt.plot(data_day_min['min_obs_altd_all'], marker='.', markersize=3, color='#9467bd', linestyle='-', label='Model (full network)', zorder=1)
+    	# Plot data (multiple days) - figure specs are collected and drawn after the loop
+    	figure_specs.append(timeseries_spec(os.path.join(out_path, "{0}_{1}_day_min.jpg".format(airport, period)), \
+                                            [(data_day_min['GNSS_ALTD'], {'marker': '.', 'markersize': 3, 'color': '#1f77b4', 'linestyle': '-', 'label': 'Mode-S observed daily minimum', 'zorder': 4}), \
+                                             (data_day_min['min_obs_altd_exist'], {'marker': '.', 'markersize': 3, 'color': '#ff7f0e', 'linestyle': '-', 'label': 'Model (existing network)', 'zorder': 3}), \
+                                             (data_day_min['min_obs_altd_priority'], {'marker': '.', 'markersize': 3, 'color': '#2ca02c', 'linestyle': '-', 'label': 'Model (priority network)', 'zorder': 2}), \
+                                             (data_day_min['min_obs_altd_all'], {'marker': '.', 'markersize': 3, 'color': '#9467bd', 'linestyle': '-', 'label': 'Model (full network)', 'zorder': 1})], \
+                                            '{0} airport - {1} '.format(airport, period), [start_date, end_date], [-250, 3000], \
+                                            np.arange(start_date, end_date, 7)))
 
-    	ax1.set_title('{0} airport - {1} '.format(airport, period))
-    	ax1.set_xlabel('Date')
-    	ax1.set_xlim([start_date, end_date])
-    	ax1.xaxis.set_major_formatter(dates.DateFormatter('%d/%m/%Y'))
-    	ax1.set_xticks(np.arange(start_date, end_date, 7))
+    # Draw the plots of all airports (in n_plot_workers processes)
+    with timed_stage(report, 'plotting', figures=len(figure_specs) if make_plots else 0):
+        render_figures(figure_specs, n_plot_workers, make_plots)
 
-    	ax1.set_ylabel('Altitude / m')
-    	ax1.set_ylim([-250, 3000])
-
-    	plt.legend(loc='upper right', prop={'size':12}, facecolor='white')
-    	ax1.axhline(y=0, xmin=0, xmax=1, linewidth =1, linestyle = '--', color='black')
-    	plt.tight_layout()
-    	plt.savefig(os.path.join(out_path, "{0}_{1}_day_min.jpg".format(airport, period)))
-    	#plt.show() 
-    	plt.close(fig1)
 
+    if model_grid is not None:
+        close_model_grid(model_grid)
 
     # 6. Export airport stats as csv
+    stats_df = pd.concat(stats_list, axis=1)
     stats_df.columns = airport_name_list
     stats_df = stats_df.transpose()
-    stats_df.to_csv(os.path.join(out_path, 'Airport_min_mode-s_stats_{0}.csv'.format(period)))
+    with timed_stage(report, 'export', rows_out=len(stats_df)):
+        stats_df.to_csv(os.path.join(out_path, 'Airport_min_mode-s_stats_{0}.csv'.format(period)))
+
+    write_run_report(report, out_path)
 
 
 if __name__ == '__main__':
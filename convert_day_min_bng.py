@@ -0,0 +1,129 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+convert_day_min_bng.py
+
+Code for extracting the daily minimum Mode-S altitudes near UK airports and converting their locations to British Grid
+(replaces 4.Convert_daily_min_lat_lon.ipynb so it can run without ArcGIS - output is read by compare_modes_model.py)
+
+To run the code:
+   ./convert_day_min_bng.py
+'''
+
+import logging
+import numpy as np
+import os
+import datetime
+from datetime import timedelta
+
+from geo_tools import convert_to_british_grid
+from metdb_io import import_metdb_file, concat_metdb_frames
+from altitude_stats import daily_minimum, stream_daily_minimum
+from run_report import new_run_report, timed_stage, add_stage, write_run_report, setup_logging
+
+logger = logging.getLogger('convert_day_min_bng')
+
+
+def main():
+
+    #---------------------------------------------------------------------
+    # 01. Settings
+    #---------------------------------------------------------------------
+
+    file_path = '/data/users/gdaron/Mode-S_altitude/MetDB_extract/'
+    out_path = '/data/users/gdaron/Mode-S_altitude/Mode-S_day_min'
+    cache_path = '/data/users/gdaron/Mode-S_altitude/MetDB_cache' # Parquet cache of parsed extracts (set to None to always read the raw files)
+    stream_chunksize = None # None to load whole days through the cache, or a row count to stream the raw extracts in chunks (bypasses the cache)
+
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+
+    period = 'winter' # summer or winter
+
+    if period == 'summer':
+        start_date = datetime.date(2021,7,10)
+        end_date = datetime.date(2021,8,10)
+
+    if period == 'winter':
+        start_date = datetime.date(2022,1,1)
+        end_date = datetime.date(2022,1,31)
+
+    date_list = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    date_list = [date_obj.strftime('%Y%m%d') for date_obj in date_list]
+
+    airport_name_list = ['Heathrow', \
+                         'Gatwick', \
+                         'Manchester', \
+                         'Stansted', \
+                         'Edinburgh', \
+                         'Birmingham', \
+                         'Bristol', \
+                         'Glasgow', \
+                         'Aberdeen', \
+                         'EastMidlands', \
+                         'LondonCity', \
+                         'BelfastInt', \
+                         'Newcastle', \
+                         'LeedsBradford', \
+                         'Liverpool',\
+                         'Cardiff']
+
+    log_level = 'INFO' # 'DEBUG' to log every airport/date, 'WARNING' for errors/warnings only
+
+    setup_logging(log_level)
+
+    report = new_run_report('convert_day_min_bng', {'period': period, 'airports': airport_name_list})
+
+    #---------------------------------------------------------------------
+    # 02. Loop through airports/dates, find daily mins, convert to British Grid and export
+    #---------------------------------------------------------------------
+
+    for airport in airport_name_list:
+
+        with timed_stage(report, 'load'):
+            if stream_chunksize is not None:
+                # Stream the extracts in chunks, keeping only the running daily mins in memory
+                logger.debug('Loading data for: %s %s-%s', airport, date_list[0], date_list[-1])
+                concat_modes_day_min, _, _ = stream_daily_minimum(file_path, 'MODE-S', airport, date_list, 'GNSS_ALTD', stream_chunksize)
+
+            else:
+                modes_frames = []
+
+                for date in date_list:
+
+                    logger.debug('Loading data for: %s %s', airport, date)
+
+                    data_modes = import_metdb_file(file_path, 'MODE-S', airport, date, cache_path)
+
+                    if type(data_modes) == int: # no file for this airport/date
+                        continue
+
+                    modes_frames.append(data_modes)
+                    add_stage(report, 'load', files_read=1, rows_in=len(data_modes))
+
+                # Find rows containing the daily mins (all days in one pass)
+                concat_modes_day_min = daily_minimum(concat_metdb_frames(modes_frames), 'GNSS_ALTD') if len(modes_frames) > 0 else None
+
+        if concat_modes_day_min is None: # no files for this airport
+            logger.warning('No Mode-S files for %s %s-%s', airport, date_list[0], date_list[-1])
+            continue
+
+        with timed_stage(report, 'convert', rows_out=len(concat_modes_day_min)):
+            concat_modes_day_min.reset_index(inplace=True)
+            concat_modes_day_min['TIME'] = concat_modes_day_min['TIME'].dt.strftime('%Y%m%d') # date format read by compare_modes_model.py
+
+            # Convert day min lat/lon to British Grid (all points in one call, LAT/LON columns hold northing/easting as in the notebook)
+            easting, northing = convert_to_british_grid(concat_modes_day_min['LAT'], concat_modes_day_min['LON'])
+            concat_modes_day_min['LAT'] = np.round(northing, 2)
+            concat_modes_day_min['LON'] = np.round(easting, 2)
+
+        with timed_stage(report, 'export', files_written=1):
+            concat_modes_day_min.to_csv(os.path.join(out_path, "{0}_{1}_day_min_BG.csv".format(airport, period)), index=False)
+
+        logger.info('%s: %d daily minimums written', airport, len(concat_modes_day_min))
+
+    write_run_report(report, out_path)
+
+if __name__ == '__main__':
+    main()
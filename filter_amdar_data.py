@@ -12,38 +12,32 @@ To run the code:
 Author: gdaron
 '''
 
-import csv
+import logging
 import pandas as pd
-import numpy as np
 import os
-import matplotlib.pyplot as plt
-from matplotlib import dates
 import datetime
 from datetime import timedelta
-import pyproj
-from matplotlib.ticker import PercentFormatter
+from concurrent.futures import ProcessPoolExecutor
+
+from geo_tools import calculate_orientation, build_airport_index, find_nearest_airports
+from runway_tools import build_runway_index, longest_runway_headings, angle_difference
+from observation_store import import_store_day, store_filename
+from metdb_io import import_metdb_file, read_excel_snapshot, clean_identifier, metdb_filename, LOADER_VERSION
+from incremental import load_manifest, save_manifest, result_signature, is_up_to_date, load_result, save_result
+from histogram_cube import build_histogram_cube, save_histogram_cube, select_histogram
+from plotting import histogram_spec, render_figures
+from run_report import new_run_report, timed_stage, add_stage, merge_stages, write_run_report, setup_logging
+
+logger = logging.getLogger('filter_amdar_data')
 
 
 #-----------------------------------------------
 # Function for importing AMDAR files
 #-----------------------------------------------
 
-def import_amdar_files(file_path, data_type, airport, date):
+def import_amdar_files(file_path, data_type, airport, date, cache_path=None):
 
-    filename = '{0}/{1}/{2}/{1}_{3}.txt'.format(file_path, data_type, airport, date) 
-
-    if not os.path.isfile(filename):
-        return -1
-
-    data = pd.read_csv(filename)
-
-    data['TIME'] = data['TIME'].astype(str) # convert time to string so '--' can be replaced
-
-    data['TIME'] = data['TIME'].str.replace('--', '00') # replace null seconds with 00   
-
-    data['TIME'] = pd.to_datetime(data['TIME'], format='%Y%m%d%H%M%S')
-
-    data.set_index('TIME', inplace=True)
+    data = import_metdb_file(file_path, data_type, airport, date, cache_path) # parsed data is cached if cache_path is set
 
     return(data)
 
@@ -55,7 +49,7 @@ def import_amdar_files(file_path, data_type, airport, date):
 def import_airport_info(file_path_info):
 
     filename = '{0}/airports_GBonly_study.csv'.format(file_path_info)
-    print(filename) 
+    logger.debug('Reading %s', filename)
 
     if not os.path.isfile(filename):
         return -1
@@ -72,7 +66,7 @@ def import_airport_info(file_path_info):
 def import_runway_info(file_path_info):
 
     filename = '{0}/runways.csv'.format(file_path_info)
-    print(filename) 
+    logger.debug('Reading %s', filename)
 
     if not os.path.isfile(filename):
         return -1
@@ -89,249 +83,171 @@ def import_runway_info(file_path_info):
 def import_aircraft_id(file_path_info):
 
     filename = '{0}/E-AMDAR Master List Dec 2021.xlsx'.format(file_path_info)
-    print(filename) 
+    logger.debug('Reading %s', filename)
 
     if not os.path.isfile(filename):
         return -1
 
-    data = pd.read_excel(filename, sheet_name='MASTER')
+    data = read_excel_snapshot(filename, 'MASTER') # Parquet snapshot of the sheet, re-read from Excel only when the .xlsx changes
 
     return(data)
 
 
 #-----------------------------------------------
-# Function for filtering AMDAR data
+# Function for splitting the AMDAR data into individual Ascents/Descents (one pass over the whole day)
+# Sorts by aircraft and time, and starts a new profile for each new aircraft or where the time gap is exceeded
 #-----------------------------------------------
 
-def filter_data(df, column, condition):
+PHASE_IDS = {'Ascent': 5, 'Descent': 6}
 
-    filter = df[column] == condition
-    filter_df = pd.DataFrame(df.loc[filter])
+def segment_profiles(df, phase, time_gap, max_altd=1000):
 
-    return(filter_df)
+    phase_id = PHASE_IDS[phase]
 
+    select_phase = df[(df.FLGT_PHAS == phase_id) & (df.ALTD < max_altd)] # Retain only data below 1000 m
+    select_phase = select_phase.reset_index()
+    select_phase = select_phase.sort_values(by = ['RGSN_NMBR', 'TIME'], kind='mergesort')
+    select_phase.reset_index(drop=True, inplace=True)
 
-#-----------------------------------------------
-# Function for splitting datafame where column is True (based on selected time gap)
-#-----------------------------------------------
+    new_aircraft = select_phase['RGSN_NMBR'] != select_phase['RGSN_NMBR'].shift(1)
+    gap = select_phase['TIME'].diff() > pd.to_timedelta(time_gap) # look for gaps
 
-def split_dataframe_by_column(df, column):
+    select_phase['profile_id'] = (new_aircraft | gap).cumsum() - 1
 
-    previous_index = df.index[0]
+    return(select_phase)
 
-    for split_point in df[df[column]].index:
-        yield df[previous_index:split_point]
-        previous_index = split_point
 
-    # Yield remainder of dataset
-    try:
-        yield df[split_point:]
-    except UnboundLocalError:
-        pass # There is no split point => Ignore
+#-----------------------------------------------
+# Function for finding runway orientation of the nearest airports (all rows at once, from the runway index)
+# airport_ids holds the ident of the nearest airport for each row of df
+#-----------------------------------------------
 
+def find_runway_orientation(df, runway_index, airport_ids):
+    
+    #CAN WE IMPROVE THE SELECTION OF THE RIGHT RUNWAY? TO DO (longest runway for now)
+    runway_orient_he, runway_orient_le = longest_runway_headings(runway_index, airport_ids)
+    
+    df['runway_orientation_he'] = runway_orient_he
+    df['runway_orientation_le'] = runway_orient_le
 
+    df['difference_he'] = angle_difference(df['orientation'], runway_orient_he)
+    df['difference_le'] = angle_difference(df['orientation'], runway_orient_le)
+    return(df)
+    
 #-----------------------------------------------
-# Function for calculating the orientation of the AMDAR data between consecutive points
+# Function for comparing the orientation of all Ascents/Descents with the runway orientation (calls other functions)
+# Returns the profiles (with orientation columns) and a summary with one row per profile
+# If a run report is given, the time of the orientation, nearest airport and runway match stages is recorded
 #-----------------------------------------------
 
-def calculate_orientation(df, lat_col, lon_col):
+def compare_orientation(profiles, phase, min_points_in_profile, airport_index, runway_index, report=None):
 
-    geodesic = pyproj.Geod(ellps='WGS84')
+    # Only keep profiles with enough points
+    profile_size = profiles.groupby('profile_id')['profile_id'].transform('size')
+    profiles = profiles[profile_size > min_points_in_profile]
 
-    df['LAT2'] = df[lat_col].shift(1)
-    df['LON2'] = df[lon_col].shift(1)
+    # Sort each profile by altitude (so the lowest point is first for an Ascent and last for a Descent)
+    profiles = profiles.sort_values(by = ['profile_id', 'ALTD'], ascending = [True, phase == 'Ascent'], kind='mergesort')
+    profiles.reset_index(drop=True, inplace=True)
 
-    list = []
-    for i, row in df.iterrows():
-    	long1 = row[lon_col]
-    	lat1 = row[lat_col]
-    	long2 = row['LON2']
-    	lat2 = row['LAT2']
-    	
-    	if lat1 == lat2 and long1 == long2:
-    		back_azimuth = float('NaN') # don't calculate orientation if points are at the same location
-    	else:
-    		fwd_azimuth,back_azimuth,distance = geodesic.inv(long1, lat1, long2, lat2)
-    		if back_azimuth <0:
-    			back_azimuth = back_azimuth + 360
-    	list.append(back_azimuth)
-
-    df['orientation'] = list
-    df.drop(['LAT2'], axis=1, inplace=True)
-    df.drop(['LON2'], axis=1, inplace=True)
-    
-    return(df)
+    # call function to calculate the orientation of the AMDAR data (within each profile)
+    with timed_stage(report, 'orientation', rows_in=len(profiles), profiles=profiles['profile_id'].nunique()):
+    	calculate_orientation(profiles, 'LAT', 'LON', group_col='profile_id')
 
+    # identify the nearest airport to the lowest point of every profile (in one query)
+    with timed_stage(report, 'nearest_airport'):
+    	if phase == 'Ascent': # choose first row
+    		endpoints = profiles.groupby('profile_id').head(1)
+    	if phase == 'Descent': # choose last row
+    		endpoints = profiles.groupby('profile_id').tail(1)
 
-#-----------------------------------------------
-# Function for finding nearest airport 
-#-----------------------------------------------
-
-def find_nearest_airport(df, phase, airport_info_df, airport_lat_col, airport_lon_col):
+    	airport_nearest = find_nearest_airports(airport_index, endpoints['LAT'], endpoints['LON'])
+    	airport_nearest.index = endpoints['profile_id'].to_numpy()
 
-    if phase == 'Ascent': # choose first row
-    	lat2 = df.loc[0,'LAT' ]
-    	lon2 = df.loc[0,'LON' ]
+    	profiles['nearest airport'] = profiles['profile_id'].map(airport_nearest['name'])
+    	airport_ids = profiles['profile_id'].map(airport_nearest['ident'])
+    	add_stage(report, 'nearest_airport', points=len(endpoints))
 
-    if phase == 'Descent': # choose last row
-    	lat2 = df.loc[len(df)-1,'LAT' ]
-    	lon2 = df.loc[len(df)-1,'LON' ]
+    # get runway orientation for the nearest airports and calculate difference to AMDAR (all profiles at once)
+    with timed_stage(report, 'runway_match'):
+    	find_runway_orientation(profiles, runway_index, airport_ids)
+    	add_stage(report, 'runway_match', airports=airport_ids.nunique())
 
-    geodesic = pyproj.Geod(ellps='WGS84')
+    # JUST CHOOSE FIRST AND LAST TWO POINTS
+    if phase == 'Ascent':
+    	summary_df = profiles[profiles.groupby('profile_id').cumcount() == 1]
+    if phase == 'Descent':
+    	summary_df = profiles.groupby('profile_id').tail(1)
 
-    list = []
-    		
-    for i, row in airport_info_df.iterrows():
-    	lon1 = row[airport_lon_col]
-    	lat1 = row[airport_lat_col]
+    summary_df = summary_df.reset_index(drop=True)
 
-    	fwd_azimuth,back_azimuth,distance = geodesic.inv(lon1, lat1, lon2, lat2)
-    	list.append(distance)
-    		
-    airport_info_df['distance'] = list
-  
-    airport_nearest = airport_info_df[airport_info_df.distance == airport_info_df.distance.min()]
+    return(profiles, summary_df)
 
-    to_list = airport_nearest['name'].tolist() # get name of nearest airport (convert to list to remove index)
-    airport_name = to_list[0]
-    print('Nearest airport is: '+airport_name)
-    df['nearest airport'] = airport_name
-
-    to_list = airport_nearest['ident'].tolist() # get ID of nearest airport (convert to list to remove index)
-    airport_id = to_list[0]
-    
-    return(airport_id, df)
 
 #-----------------------------------------------
-# Function for finding runway orientation of nearest airport 
+# Function for adding flight operator to table
 #-----------------------------------------------
 
-def find_runway_orientation (df, runway_info_df, airport_id):
-    
-    find_runway = runway_info_df.loc[runway_info_df['airport_ident'] == airport_id]
-    find_runway.reset_index(inplace=True)
-    
-    '''
-    #CAN WE IMPROVE THE SELECTION OF THE RIGHT RUNWAY? TO DO
-    runway_list = find_runway['he_heading_degT'].tolist()
-    print(runway_list)
-
-    for runway_orient_he in runway_list:
-    	if runway_orient_he >=0 and runway_orient_he <180:
-    		runway_orient_le = runway_orient_he + 180
-    	else:
-    		runway_orient_le = runway_orient_he - 180
-    '''
+def add_operator(summary_df, aircraft_id_info):
 
-    find_runway_longest = find_runway[find_runway.length_ft == find_runway.length_ft.max()] # choose longest runway if more than one
-    to_list = find_runway_longest['he_heading_degT'].tolist() # convert to list to remove index
-    runway_orient_he = to_list[0]
+    summary_df['aircraft_id'] = clean_identifier(summary_df['RGSN_NMBR']) #remove b' and spaces from aircraft id
+
+    operators = aircraft_id_info.drop_duplicates(subset='Identifier', keep='first') # first match in master list
+    operators = operators.set_index('Identifier')['Operator ICAO']
+
+    summary_df['operator'] = summary_df['aircraft_id'].map(operators)
+
+    return(summary_df)
 
-    if runway_orient_he >=0 and runway_orient_he <180:
-    	runway_orient_le = runway_orient_he + 180
-    else:
-    	runway_orient_le = runway_orient_he - 180
-    
-    df['runway_orientation_he'] = runway_orient_he
-    df['runway_orientation_le'] = runway_orient_le
 
-    df['difference_he'] = (df['orientation'] - df['runway_orientation_he'] + 180 + 360) % 360 - 180 
-    df['difference_le'] = (df['orientation'] - df['runway_orientation_le'] + 180 + 360) % 360 - 180
-    return(df)
-    
 #-----------------------------------------------
-# Function for finding individual Ascents/Descents and comparing orientation with the runway orientation (calls other functions)
+# Functions for processing one airport/date (run in the main process, or in a pool of worker processes)
+# The airport and runway indexes are built once per process and kept in reference_tables
+# Returns the summary and the stages recorded for the run report (merged into the report by the main process)
 #-----------------------------------------------
 
-def compare_orientation(df, phase, min_points_in_profile, airport_info_df, runway_info_df, summary_df):
-
+reference_tables = {}
 
-    if 'gap' in df.columns: # present if dataframe has been split
-    	df.drop(['gap'], axis=1, inplace=True)
+def load_reference_tables(file_path_info):
 
-    if phase == 'Ascent':
-    	df = df.sort_values(by = 'ALTD')
-    if phase == 'Descent':
-    	df = df.sort_values(by = 'ALTD', ascending=False)
+    airport_info = import_airport_info(file_path_info)
 
-    df.reset_index(inplace=True)
+    reference_tables['airport_index'] = build_airport_index(airport_info, 'latitude_deg', 'longitude_deg') # spatial index of airports (built once)
+    reference_tables['runway_index'] = build_runway_index(import_runway_info(file_path_info)) # runway headings by airport (built once)
 
-    # call function to calculate the orientation of the AMDAR data
-    calculate_orientation(df, 'LAT', 'LON')
 
-    # call function to identify the nearest airport
-    airport_id, df = find_nearest_airport(df, phase, airport_info_df, 'latitude_deg', 'longitude_deg')
+def process_airport_day(file_path, airport, date, phase, time_gap, max_altd, min_points_in_profile, cache_path, store_path=None):
 
-    # call function to get runway orientation for nearest airport and calculate difference to AMDAR
-    find_runway_orientation (df, runway_info_df, airport_id)
-    
-    df.drop(['index'], axis=1, inplace=True)
-    '''
-    # CHECK IF FIRST TWO POINTS OF ASCENT ARE AT THE SAME LOCATION AND CHOOSE NEXT PAIR IF SO
-    if phase == 'Ascent':
-    	lat1 = df.loc[1,'LAT']
-    	lat2 = df.loc[2,'LAT']
-    	lon1 = df.loc[1,'LON']
-    	lon2 = df.loc[2,'LON']
-    	if lat1 == lat2 and lon1 == lon2:
-    		test = pd.DataFrame(df.iloc[2,:])
-    	else:
-    		test = pd.DataFrame(df.iloc[1,:])
-    	test = test.transpose()
-    if phase == 'Descent':
-    	test = pd.DataFrame(df.iloc[len(df)-1,:])
-    	test = test.transpose()
-    '''
-    
-    # JUST CHOOSE FIRST AND LAST TWO POINTS
-    if phase == 'Ascent':
-    	test = pd.DataFrame(df.iloc[1,:])
-    	test = test.transpose()
-    if phase == 'Descent':
-    	test = pd.DataFrame(df.iloc[len(df)-1,:])
-    	test = test.transpose()
-    
-    summary_df = pd.concat([summary_df, test])
-    
-    return(df, summary_df)
+    logger.debug('Loading data for: %s %s', airport, date)
 
+    report = {'stages': {}}
 
-#-----------------------------------------------
-# Function for adding flight operator to table
-#-----------------------------------------------
+    with timed_stage(report, 'load'):
+    	if store_path is not None: # only the rows of the phase below max_altd are read from the store
+    		data_amdar = import_store_day(store_path, 'AMDARS', airport, date, max_altd=max_altd, flight_phase=PHASE_IDS[phase])
+    	else:
+    		data_amdar = import_amdar_files(file_path, 'AMDARS', airport, date, cache_path)
 
-def add_operator(summary_df, aircraft_id_info):
+    if type(data_amdar) == int: # no file for this airport/date
+    	add_stage(report, 'load', files_missing=1)
+    	return(pd.DataFrame(), report['stages'])
 
-    aircraft_id_list = []
-    operator_list = []
+    add_stage(report, 'load', files_read=1, rows_out=len(data_amdar))
 
-    sub1 = "b'"
-    sub2 = "  '"
-    sub3 = "'"
+    # Split into individual Ascents/Descents (for all aircraft at once), one profile_id per Ascent/Descent
+    with timed_stage(report, 'segment', rows_in=len(data_amdar)):
+    	profiles = segment_profiles(data_amdar, phase, time_gap, max_altd)
+    add_stage(report, 'segment', rows_out=len(profiles), profiles=profiles['profile_id'].nunique())
 
-    for i, row in summary_df.iterrows(): #remove b' and spaces from aircraft id
-    	rgsn_nmbr = summary_df.loc[i,'RGSN_NMBR'] 
-    	idx1 = rgsn_nmbr.index(sub1)
-    	if (rgsn_nmbr.find(sub2) == -1):
-    		idx2 = rgsn_nmbr.index(sub3)
-    	else:
-    		idx2 = rgsn_nmbr.index(sub2)
-    	aircraft_id = rgsn_nmbr[idx1 + len(sub1): idx2]
-    	aircraft_id_list.append(aircraft_id)
-
-    	find_airline = aircraft_id_info.loc[aircraft_id_info['Identifier'] == aircraft_id]
-    	to_list = find_airline['Operator ICAO'].tolist()
-    	if len(to_list) == 0:
-    		to_list = ['NaN']
-    		operator_list.append(to_list[0])
-    	else:
-    		operator_list.append(to_list[0])
+    if profiles.empty == True:
+    	return(pd.DataFrame(), report['stages'])
 
+    profiles, summary_df = compare_orientation(profiles, phase, min_points_in_profile, reference_tables['airport_index'], reference_tables['runway_index'], report)
+    #profiles.to_csv(os.path.join(out_path, 'AMDAR_{0}_{1}_{2}.csv'.format(airport, date, phase )), index=False, na_rep='NaN')
 
-    summary_df['aircraft_id'] = aircraft_id_list
-    summary_df['operator'] = operator_list
+    add_stage(report, 'runway_match', rows_out=len(summary_df))
 
-    return(summary_df)
+    return(summary_df, report['stages'])
 
 
 def main():
@@ -344,6 +260,9 @@ def main():
     file_path = '/data/users/gdaron/MetDB/'
     file_path_info = '/data/users/gdaron/Mode-S_altitude/AMDAR_location_issue/Runway_orientation/AirportInfo'
     out_path = '/data/users/gdaron/Mode-S_altitude/AMDAR_location_issue/Runway_orientation/AMDAR_filter'
+    cache_path = '/data/users/gdaron/MetDB/cache' # Parquet cache of parsed extracts (set to None to always read the raw files)
+    store_path = None # partitioned observation store built by observation_store.py (e.g. '/data/users/gdaron/MetDB/store'), None to read the extract files
+    incremental_path = out_path+'/incremental' # airport/date results are reused while their inputs and settings are unchanged (set to None to always recompute)
 
     if not os.path.exists(out_path):
         os.makedirs(out_path)
@@ -354,8 +273,17 @@ def main():
 
     min_points_in_profile = 2
 
+    max_altd = 1000 # Retain only data below this altitude (m)
+
     time_gap = '5 minutes' # used to find gaps in timeseries and separate aircraft that have multiple Ascents/Descents in one day
 
+    n_workers = 1 # number of processes used for the airport/date loop (1 = run in this process)
+
+    make_plots = True # False for compute-only runs (no figures are drawn)
+    n_plot_workers = 4 # number of processes used for drawing the figures
+
+    log_level = 'INFO' # 'DEBUG' to log every airport/date and file read, 'WARNING' for errors/warnings only
+
     #airport_name_list = ['Aberdeen']
     
     airport_name_list = ['Heathrow', \
@@ -397,73 +325,63 @@ def main():
     date_list = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
     date_list = [date_obj.strftime('%Y%m%d') for date_obj in date_list]
 
+    setup_logging(log_level)
+
+    report = new_run_report('filter_amdar_data', {'period': period, 'phase': phase, 'min_points_in_profile': min_points_in_profile, \
+                                                  'max_altd': max_altd, 'time_gap': time_gap, 'n_workers': n_workers, 'airports': airport_name_list})
+
     #---------------------------------------------------------------------    
     # 03. Import airport and runway information
     #---------------------------------------------------------------------
 
-    airport_info = import_airport_info(file_path_info)
-    runway_info = import_runway_info(file_path_info)
-    aircraft_id_info = import_aircraft_id(file_path_info)
+    with timed_stage(report, 'reference_tables'):
+    	aircraft_id_info = import_aircraft_id(file_path_info) # only needed for the summary (step 06)
     
     #---------------------------------------------------------------------    
     # 04. Loop through airports/dates and find individual Ascents/Descents
     #---------------------------------------------------------------------
 
-    for_hist = pd.DataFrame()
-
-    for airport in airport_name_list: 
-
-    	for date in date_list:
-
-    		print('Loading data for: {0} {1}'.format(airport, date))
-
-    		data_amdar = import_amdar_files(file_path, 'AMDARS', airport, date)
-
-    		# Filter the dataframe for aircraft number and flight phase
-
-    		aircraft_list = data_amdar.RGSN_NMBR.unique()
-
-    		for aircraft in aircraft_list:
-
-    			print('Processing aircraft no: {0}'.format(aircraft))
-
-    			aircraft_df = filter_data(data_amdar, 'RGSN_NMBR', aircraft)
-    			aircraft_df.sort_values(by = 'TIME')
-
-    			if phase == 'Ascent':
-    				phase_id = 5
-    			if phase == 'Descent':
-    				phase_id = 6
-    			
-    			select_phase = aircraft_df[aircraft_df.FLGT_PHAS == phase_id].copy()
-    			select_phase = select_phase[select_phase.ALTD < 1000] # Retain only data below 1000 m
-
-    			select_phase.reset_index(inplace=True)
-    			
-			# Split dataframes where the same aircraft has multiple Ascents/Descents (in a day)
+    tasks = [(file_path, airport, date, phase, time_gap, max_altd, min_points_in_profile, cache_path, store_path) for airport in airport_name_list for date in date_list]
+    keys = ['{0}_{1}_{2}'.format(airport, date, phase) for airport in airport_name_list for date in date_list]
+    summaries = [None] * len(tasks)
+
+    # Incremental mode: reuse the summary of any airport/date whose input files and settings are unchanged
+    if incremental_path is not None:
+    	manifest = load_manifest(incremental_path)
+    	params = {'phase': phase, 'time_gap': time_gap, 'max_altd': max_altd, 'min_points_in_profile': min_points_in_profile, \
+                  'loader_version': LOADER_VERSION}
+    	reference_files = ['{0}/airports_GBonly_study.csv'.format(file_path_info), '{0}/runways.csv'.format(file_path_info)]
+    	amdar_files = [store_filename(store_path, 'AMDARS', airport, date) if store_path is not None else metdb_filename(file_path, 'AMDARS', airport, date) \
+                       for airport in airport_name_list for date in date_list]
+    	signatures = [result_signature(manifest, [amdar_file] + reference_files, params) for amdar_file in amdar_files]
+    	for i, key in enumerate(keys):
+    		if is_up_to_date(manifest, incremental_path, key, signatures[i]):
+    			summaries[i] = load_result(incremental_path, key)
+
+    todo = [i for i in range(len(tasks)) if summaries[i] is None]
+    logger.info('Processing %d of %d airport/dates', len(todo), len(tasks))
+    add_stage(report, 'incremental', results_reused=len(tasks) - len(todo), results_computed=len(todo))
+
+    if len(todo) == 0:
+    	results = []
+    elif n_workers == 1:
+    	load_reference_tables(file_path_info)
+    	results = [process_airport_day(*tasks[i]) for i in todo]
+    else:
+    	# each worker loads the airport/runway tables once, results are returned in the order of tasks
+    	with ProcessPoolExecutor(max_workers=n_workers, initializer=load_reference_tables, initargs=(file_path_info,)) as executor:
+    		results = list(executor.map(process_airport_day, *zip(*[tasks[i] for i in todo])))
 
-    			if select_phase.empty == True:
-    				pass
-    			
-    			else:
-    				select_phase['gap'] = select_phase['TIME'].diff() > pd.to_timedelta(time_gap) # look for gaps  
-    				select_phase[select_phase.gap]
-    				
-    				split_frames = list(split_dataframe_by_column(select_phase, "gap"))
+    for i, (summary_df, stages) in zip(todo, results):
+    	merge_stages(report, stages)
+    	summaries[i] = summary_df
+    	if incremental_path is not None:
+    		save_result(manifest, incremental_path, keys[i], signatures[i], summary_df)
 
-    				if len(split_frames) == 0:
-    					if len(select_phase) > min_points_in_profile:
-    						select_phase, for_hist = compare_orientation(select_phase, phase, min_points_in_profile, airport_info, runway_info, for_hist)
-    						#select_phase.to_csv(os.path.join(out_path, 'AMDAR_{0}_{1}_{2}_{3}_1.csv'.format(airport, aircraft, date, phase )), \
-                                                                    #index=False, na_rep='NaN')
+    if incremental_path is not None:
+    	save_manifest(manifest, incremental_path)
 
-    				else:
-    					for i in (1,len(split_frames)):
-    						split_df = pd.DataFrame(split_frames[i - 1])
-    						if len(split_df) > min_points_in_profile:
-    							split_df, for_hist = compare_orientation(split_df, phase, min_points_in_profile, airport_info, runway_info, for_hist)
-    							#split_df.to_csv(os.path.join(out_path, 'AMDAR_{0}_{1}_{2}_{3}_1.csv'.format(airport, aircraft, date, phase )), \
-                                                                        #index=False, na_rep='NaN')
+    for_hist = pd.concat([summary_df.assign(airport=tasks[i][1]) for i, summary_df in enumerate(summaries)]) # airport of the extract file
 
 
     #---------------------------------------------------------------------    
@@ -474,58 +392,44 @@ def main():
     for_hist.reset_index(inplace=True)
     for_hist.drop(['index'], axis=1, inplace=True)
 
-    fig1, ax1 = plt.subplots(figsize=(4,4))
-    bins = [0,10,20,30,40,50,60,70,80,90]
-    plt.hist(for_hist['abs_difference_min'], weights=np.ones(len(for_hist['abs_difference_min'])) / len(for_hist['abs_difference_min']), bins=bins)
-    num_points = len(for_hist.dropna())
-    ax1.annotate( 'No. of profiles: ' + str(num_points) , xy = (125,200), xycoords = 'axes points')
-    ax1.set_title('{0} {1}'.format(phase, period))
-    ax1.set_xlabel('Angle (deg)')
-    ax1.set_xlim([0, 90])
-    ax1.set_xticks(np.arange(0, 90, 10))
-    plt.gca().yaxis.set_major_formatter(PercentFormatter(1))
-    ax1.set_ylim([0, 1])
-    plt.tight_layout()
-    plt.savefig(os.path.join(out_path, 'Summary_hist_{0}_{1}.jpg'.format(phase, period)))
-    plt.close(fig1)
-    #plt.show()  
+    add_operator(for_hist, aircraft_id_info)
+
+    with timed_stage(report, 'export', rows_out=len(for_hist)):
+    	for_hist.to_csv(os.path.join(out_path, 'Summary_{0}_{1}.csv'.format(phase, period)), index=False, na_rep='NaN')
+
+    # Counts of abs_difference_min in each angle bin for every airport/operator (one pass), saved for later use
+    with timed_stage(report, 'histogram_cube'):
+    	hist_cube = build_histogram_cube(for_hist.assign(phase=phase, period=period), 'abs_difference_min', ['airport', 'operator', 'phase', 'period'])
+    	save_histogram_cube(hist_cube, out_path, phase, period)
+    add_stage(report, 'histogram_cube', rows_in=len(for_hist), rows_out=len(hist_cube))
+
+    counts, n_rows, bins = select_histogram(hist_cube)
+    figure_specs = [histogram_spec(os.path.join(out_path, 'Summary_hist_{0}_{1}.jpg'.format(phase, period)), counts, n_rows, bins, \
+                                   '{0} {1}'.format(phase, period))]
 
     #----------------------------------------
     # 06. Subset data for individual airlines
     #----------------------------------------
 
-    add_operator(for_hist, aircraft_id_info)
-
-    for_hist.to_csv(os.path.join(out_path, 'Summary_{0}_{1}.csv'.format(phase, period)), index=False, na_rep='NaN')
-    
     airlines = ['AFR', 'ART', 'AUA', 'BAW', 'CCM', 'CLH', 'CSA', 'DLH', 'EIN',\
                 'EWE', 'EWG', 'EZS', 'EZY', 'FIN', 'GEC', 'IAE', 'KLM', 'LOT',\
                 'RET', 'SAS', 'SBL', 'TCX', 'THY', 'VKG', 'WZZ']
 
+    operator_out_path = out_path+'/by_operator'
+
     for airline in airlines:
-    	subset = for_hist.loc[for_hist['operator'] == airline]
-    	if len(subset) ==0:
+    	counts, n_rows, bins = select_histogram(hist_cube, operator=airline)
+    	if n_rows ==0:
     		pass
     	else:
-    		fig2, ax2 = plt.subplots(figsize=(4,4))
-    		bins = [0,10,20,30,40,50,60,70,80,90]
-    		#subset = subset.dropna()
-    		plt.hist(subset['abs_difference_min'], weights=np.ones(len(subset['abs_difference_min'])) / len(subset['abs_difference_min']), bins=bins)
-    		num_points = len(subset.dropna())
-    		ax2.annotate( 'No. of profiles: ' + str(num_points) , xy = (125,200), xycoords = 'axes points')
-    		ax2.set_title('{0} {1} {2}'.format(phase, period, airline))
-    		ax2.set_xlabel('Angle (deg)')
-    		ax2.set_xlim([0, 90])
-    		ax2.set_xticks(np.arange(0, 90, 10))
-    		plt.gca().yaxis.set_major_formatter(PercentFormatter(1))
-    		ax2.set_ylim([0, 1])
-    		plt.tight_layout()
-    		operator_out_path = out_path+'/by_operator'
-    		if not os.path.exists(operator_out_path):
-        		os.makedirs(operator_out_path)
-    		plt.savefig(os.path.join(operator_out_path, 'Operator_hist_{0}_{1}_{2}.jpg'.format(phase, period, airline)))
-    		#plt.show()
-    		plt.close(fig2)
+    		figure_specs.append(histogram_spec(os.path.join(operator_out_path, 'Operator_hist_{0}_{1}_{2}.jpg'.format(phase, period, airline)), \
+                                                   counts, n_rows, bins, '{0} {1} {2}'.format(phase, period, airline)))
+
+    # Draw all histograms (in n_plot_workers processes)
+    with timed_stage(report, 'plotting', figures=len(figure_specs) if make_plots else 0):
+    	render_figures(figure_specs, n_plot_workers, make_plots)
+
+    write_run_report(report, out_path)
     		
     	
 if __name__ == '__main__':
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+fix_metdb_headers.py
+
+Code for checking and adding missing headers to the AMDARS and MODE-S metdb outputs
+(when data is extracted from MetDB, a missing quarter may result in a missing header)
+
+Only the start of each file is read, files are checked in parallel, and a manifest of checked files
+(keyed by mtime and size) means unchanged files are skipped on the next scan.
+
+To run the code:
+   ./fix_metdb_headers.py
+'''
+
+import os
+import os.path as path
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+src_extensions = ['.txt']
+
+HEADERS = {'AMDARS': 'RGSN_NMBR,TIME,LAT,LON,ALTD',
+           'MODE-S': 'AIRCRAFT_NO,TIME,LAT,LON,PESR_ALTD,GNSS_ALTD'}
+
+HEADER_PREFIXES = {'AMDARS': 'RGSN',
+                   'MODE-S': 'AIRCRAFT'}
+
+MANIFEST_NAME = '.header_manifest.json'
+
+
+def is_src_file(f):
+    results = [f.endswith(ext) for ext in src_extensions]
+    return True in results
+
+
+#-----------------------------------------------
+# Function for checking the first line of a file (reads only the start of the file)
+#-----------------------------------------------
+
+def is_header_missing(f, header_prefix, block_size=4096):
+    with open(f, 'rb') as reader:
+        block = reader.read(block_size)
+        while block and not block.strip(): # skip leading blank lines/whitespace
+            block = reader.read(block_size)
+
+    if len(block) == 0: return True # empty file
+    return not block.lstrip().startswith(header_prefix.encode())
+
+
+#-----------------------------------------------
+# Function for adding the header to a file (streamed copy to a temporary file, then an atomic rename)
+#-----------------------------------------------
+
+def add_header(f, header):
+    tmp_file = f + '.tmp'
+    with open(tmp_file, 'wb') as writer:
+        writer.write((header + '\n').encode())
+        with open(f, 'rb') as reader:
+            shutil.copyfileobj(reader, writer)
+
+    shutil.copymode(f, tmp_file) # keep the permissions of the original
+    os.replace(tmp_file, f)
+
+
+#-----------------------------------------------
+# Functions for the manifest of checked files (path -> [mtime_ns, size])
+#-----------------------------------------------
+
+def file_signature(f):
+    stat = os.stat(f)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def load_manifest(dirname):
+    manifest_file = path.join(dirname, MANIFEST_NAME)
+    if not path.isfile(manifest_file):
+        return {}
+    with open(manifest_file) as reader:
+        return json.load(reader)
+
+
+def save_manifest(dirname, manifest):
+    manifest_file = path.join(dirname, MANIFEST_NAME)
+    with open(manifest_file + '.tmp', 'w') as writer:
+        json.dump(manifest, writer)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
+#-----------------------------------------------
+# Function for finding files with missing headers (skips files unchanged since the last scan)
+#-----------------------------------------------
+
+def get_src_files(dirname, header_prefix, manifest, n_workers=8):
+    src_files = []
+    for cur, _dirs, files in os.walk(dirname):
+        [src_files.append(path.join(cur,f)) for f in files if is_src_file(f)]
+
+    signatures = {f: file_signature(f) for f in src_files}
+    to_check = [f for f in src_files if manifest.get(path.relpath(f, dirname)) != signatures[f]]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        missing = list(executor.map(lambda f: is_header_missing(f, header_prefix), to_check))
+
+    for f, header_missing in zip(to_check, missing):
+        if not header_missing:
+            manifest[path.relpath(f, dirname)] = signatures[f]
+
+    return [f for f, header_missing in zip(to_check, missing) if header_missing]
+
+
+#-----------------------------------------------
+# Function for checking (and optionally fixing) all files below a directory
+#-----------------------------------------------
+
+def fix_headers(root_path, data_type, fix=True, n_workers=8):
+
+    header = HEADERS[data_type]
+
+    manifest = load_manifest(root_path)
+
+    files = get_src_files(root_path, HEADER_PREFIXES[data_type], manifest, n_workers)
+
+    print("Files with missing headers:")
+    [print("  - %s" % f) for f in files]
+
+    if fix:
+        print()
+        print("Header: ")
+        print(header)
+
+        for f in files:
+            add_header(f, header)
+            manifest[path.relpath(f, root_path)] = file_signature(f)
+
+    save_manifest(root_path, manifest)
+
+    return files
+
+
+if __name__ == "__main__":
+
+    file_path = '/data/users/gdaron/Mode-S_altitude/MetDB_extract'
+
+    data_type_list = ['AMDARS', 'MODE-S']
+
+    fix = True # False to only list the files with missing headers
+
+    n_workers = 8 # number of files checked at the same time
+
+    airport_name_list = ['Heathrow', \
+                     'Gatwick', \
+                     'Manchester', \
+                     'Stansted', \
+                     'Edinburgh', \
+                     'Birmingham', \
+                     'Bristol', \
+                     'Glasgow', \
+                     'Aberdeen', \
+                     'EastMidlands', \
+                     'LondonCity', \
+                     'BelfastInt', \
+                     'Newcastle', \
+                     'LeedsBradford', \
+                     'Liverpool',\
+                     'Cardiff']
+
+    for data_type in data_type_list:
+
+        for airport in airport_name_list:
+
+            root_path = '{0}/{1}/{2}'.format(file_path, data_type, airport)
+
+            if not path.isdir(root_path):
+                continue
+
+            fix_headers(root_path, data_type, fix, n_workers)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+geo_tools.py
+
+Array-based geodesic functions shared by the AMDAR/Mode-S scripts (orientation of aircraft tracks, nearest airport lookup, British Grid conversion)
+
+Usage (from another script):
+   from geo_tools import calculate_orientation, build_airport_index, find_nearest_airports
+'''
+
+import numpy as np
+import pandas as pd
+import pyproj
+
+# One ellipsoid object for the whole run (building a Geod is not free)
+GEODESIC = pyproj.Geod(ellps='WGS84')
+
+
+#-----------------------------------------------
+# Function for calculating the back azimuth between two sets of points (all pairs in one call)
+#-----------------------------------------------
+
+def calculate_back_azimuth(lat1, lon1, lat2, lon2):
+
+    lat1 = np.asarray(lat1, dtype=float)
+    lon1 = np.asarray(lon1, dtype=float)
+    lat2 = np.asarray(lat2, dtype=float)
+    lon2 = np.asarray(lon2, dtype=float)
+
+    back_azimuth = np.full(lat1.shape, np.nan)
+
+    # don't calculate orientation if points are at the same location (or the previous point is missing)
+    valid = ~((lat1 == lat2) & (lon1 == lon2))
+    valid &= ~(np.isnan(lat1) | np.isnan(lon1) | np.isnan(lat2) | np.isnan(lon2))
+
+    if valid.any():
+        fwd_azimuth, back, distance = GEODESIC.inv(lon1[valid], lat1[valid], lon2[valid], lat2[valid])
+        back_azimuth[valid] = np.where(back < 0, back + 360, back) # wrap into 0-360
+
+    return(back_azimuth)
+
+
+#-----------------------------------------------
+# Function for calculating the orientation of the AMDAR data between consecutive points
+# (group_col keeps the previous point within the same profile when several profiles are in one dataframe)
+#-----------------------------------------------
+
+def calculate_orientation(df, lat_col, lon_col, group_col=None):
+
+    if group_col is None:
+        lat2 = df[lat_col].shift(1)
+        lon2 = df[lon_col].shift(1)
+    else:
+        grouped = df.groupby(group_col, sort=False)
+        lat2 = grouped[lat_col].shift(1)
+        lon2 = grouped[lon_col].shift(1)
+
+    df['orientation'] = calculate_back_azimuth(df[lat_col].to_numpy(), df[lon_col].to_numpy(), lat2.to_numpy(), lon2.to_numpy())
+
+    return(df)
+
+
+#-----------------------------------------------
+# Function for building a spatial index of the airport table (built once, queried for all profiles)
+#-----------------------------------------------
+
+def build_airport_index(airport_info_df, airport_lat_col='latitude_deg', airport_lon_col='longitude_deg', n_candidates=5):
+
+    airport_info_df = airport_info_df.dropna(subset=[airport_lat_col, airport_lon_col]).reset_index(drop=True)
+
+    lat = airport_info_df[airport_lat_col].to_numpy(dtype=float)
+    lon = airport_info_df[airport_lon_col].to_numpy(dtype=float)
+
+    try:
+        from sklearn.neighbors import BallTree
+        tree = BallTree(np.radians(np.column_stack([lat, lon])), metric='haversine')
+    except ImportError:
+        tree = None # fall back to a (chunked) brute force haversine search
+
+    airport_index = {'info': airport_info_df,
+                     'lat': lat,
+                     'lon': lon,
+                     'tree': tree,
+                     'n_candidates': min(n_candidates, len(airport_info_df))}
+
+    return(airport_index)
+
+
+#-----------------------------------------------
+# Function for finding the closest candidate airports on the sphere (haversine)
+#-----------------------------------------------
+
+def _haversine_candidates(airport_index, lat, lon, chunk_size=2000):
+
+    k = airport_index['n_candidates']
+
+    if airport_index['tree'] is not None:
+        candidates = airport_index['tree'].query(np.radians(np.column_stack([lat, lon])), k=k, return_distance=False)
+        return(candidates)
+
+    airport_lat = np.radians(airport_index['lat'])
+    airport_lon = np.radians(airport_index['lon'])
+
+    candidates = np.empty((len(lat), k), dtype=int)
+    for start in range(0, len(lat), chunk_size):
+        plat = np.radians(lat[start:start + chunk_size])[:, None]
+        plon = np.radians(lon[start:start + chunk_size])[:, None]
+        hav = np.sin((airport_lat - plat) / 2)**2 + np.cos(plat) * np.cos(airport_lat) * np.sin((airport_lon - plon) / 2)**2
+        candidates[start:start + chunk_size] = np.argpartition(hav, k - 1, axis=1)[:, :k]
+
+    return(candidates)
+
+
+#-----------------------------------------------
+# Function for finding the nearest airport to many points in one batched query
+# (haversine search for candidates, then exact WGS84 geodesic distance to choose between them)
+#-----------------------------------------------
+
+def find_nearest_airports(airport_index, lat, lon):
+
+    lat = np.atleast_1d(np.asarray(lat, dtype=float))
+    lon = np.atleast_1d(np.asarray(lon, dtype=float))
+
+    nearest_df = pd.DataFrame({'ident': pd.Series([None] * len(lat), dtype=object),
+                               'name': pd.Series([None] * len(lat), dtype=object),
+                               'distance': np.nan})
+
+    valid = ~(np.isnan(lat) | np.isnan(lon)) # no nearest airport for points without a position
+    if not valid.any():
+        return(nearest_df)
+
+    candidates = _haversine_candidates(airport_index, lat[valid], lon[valid])
+    k = candidates.shape[1]
+
+    fwd_azimuth, back_azimuth, distance = GEODESIC.inv(airport_index['lon'][candidates].ravel(), airport_index['lat'][candidates].ravel(),
+                                                       np.repeat(lon[valid], k), np.repeat(lat[valid], k))
+    distance = np.asarray(distance).reshape(-1, k)
+
+    best = np.argmin(distance, axis=1)
+    rows = np.arange(len(candidates))
+    nearest = candidates[rows, best]
+
+    airport_info_df = airport_index['info']
+    nearest_df.loc[valid, 'ident'] = airport_info_df['ident'].to_numpy()[nearest]
+    nearest_df.loc[valid, 'name'] = airport_info_df['name'].to_numpy()[nearest]
+    nearest_df.loc[valid, 'distance'] = distance[rows, best]
+
+    return(nearest_df)
+
+
+#-----------------------------------------------
+# Function for converting WGS84 lat/lon to British National Grid easting/northing (whole columns in one call)
+# EPSG:27700 is the horizontal part of EPSG:7405 (British National Grid + ODN height) used in ArcGIS
+#-----------------------------------------------
+
+BNG_TRANSFORMER = pyproj.Transformer.from_crs('EPSG:4326', 'EPSG:27700', always_xy=True)
+
+def convert_to_british_grid(lat, lon):
+
+    easting, northing = BNG_TRANSFORMER.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+
+    return(easting, northing)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+gis_export.py
+
+Code for exporting the AMDAR and Mode-S extracts as point layers for GIS (replaces the per airport-day
+XYTableToPoint conversions of 2.Load_data_into_ArcGIS_Pro.ipynb): all the days of an airport are read and
+written in one vectorized pass, with WGS84 point geometry, to a GeoPackage (one file per airport, one layer
+per data type) or to GeoParquet (one file per airport and data type). Airports are exported in parallel.
+GeoPackage is written with sqlite3 and GeoParquet with pyarrow, so no GDAL/geopandas is needed
+
+To run the code:
+   ./gis_export.py
+
+Usage (from another script):
+   from gis_export import export_airport, write_geopackage, write_geoparquet
+'''
+
+import datetime
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyproj
+
+from metdb_io import import_metdb_file, concat_metdb_frames
+from run_report import setup_logging
+
+logger = logging.getLogger('gis_export')
+
+LAYER_NAMES = {'AMDARS': 'AMDARS', 'MODE-S': 'MODES'} # layer/file names (as the notebook feature classes)
+
+WGS84_WKT = pyproj.CRS.from_epsg(4326).to_wkt('WKT1_GDAL')
+
+
+#-----------------------------------------------
+# Function for the WKB points of many lon/lat pairs at once (little endian, 21 bytes per point), optionally
+# preceded by the GeoPackage geometry header. Returns the bytes of all points and the size of one point
+# Points without a position are flagged in the returned mask (written as NULL geometries)
+#-----------------------------------------------
+
+WKB_POINT = np.dtype([('byte_order', 'u1'), ('geometry_type', '<u4'), ('x', '<f8'), ('y', '<f8')])
+
+GPKG_POINT = np.dtype([('magic', 'S2'), ('version', 'u1'), ('flags', 'u1'), ('srs_id', '<i4'),
+                       ('byte_order', 'u1'), ('geometry_type', '<u4'), ('x', '<f8'), ('y', '<f8')])
+
+
+def point_wkb(lon, lat, gpkg_header=False):
+
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+
+    points = np.zeros(len(lon), dtype=GPKG_POINT if gpkg_header else WKB_POINT)
+    if gpkg_header:
+        points['magic'] = b'GP'
+        points['flags'] = 1 # little endian, no envelope
+        points['srs_id'] = 4326
+    points['byte_order'] = 1
+    points['geometry_type'] = 1 # Point
+    points['x'] = lon
+    points['y'] = lat
+
+    valid = ~(np.isnan(lon) | np.isnan(lat))
+
+    return(points.tobytes(), points.dtype.itemsize, valid)
+
+
+#-----------------------------------------------
+# Function for reading all the days of an airport for one data type (None if there are no files)
+#-----------------------------------------------
+
+def load_airport_days(file_path, data_type, airport, date_list, cache_path=None):
+
+    frames = [import_metdb_file(file_path, data_type, airport, date, cache_path) for date in date_list]
+    frames = [frame for frame in frames if type(frame) != int] # no file for this airport/date
+
+    if len(frames) == 0:
+        return None
+
+    data = concat_metdb_frames(frames).reset_index()
+
+    return(data)
+
+
+#-----------------------------------------------
+# Function for writing point layers to a GeoPackage (OGC GeoPackage 1.3, read by ArcGIS Pro and QGIS)
+# layers maps a layer name to a dataframe with LAT/LON columns (the other columns become attributes)
+#-----------------------------------------------
+
+GPKG_COLUMN_TYPES = {'f': 'DOUBLE', 'i': 'INTEGER', 'u': 'INTEGER', 'M': 'DATETIME'} # anything else is TEXT
+
+
+def _gpkg_values(column):
+
+    if column.dtype.kind == 'M': # ISO 8601 UTC, as required for DATETIME columns (numpy formatting, much faster than strftime)
+        text = np.char.add(np.datetime_as_string(column.to_numpy().astype('datetime64[s]'), unit='s'), 'Z').astype(object)
+        text[column.isna().to_numpy()] = None
+        return(text.tolist())
+
+    return(column.astype(object).where(column.notna(), None).tolist()) # python str/int/float values, missing values as NULL
+
+
+def write_geopackage(layers, filename):
+
+    if os.path.exists(filename + '.tmp'):
+        os.remove(filename + '.tmp')
+
+    connection = sqlite3.connect(filename + '.tmp')
+    cursor = connection.cursor()
+
+    cursor.execute('PRAGMA application_id = 1196444487') # 'GPKG'
+    cursor.execute('PRAGMA user_version = 10300')
+    cursor.execute('PRAGMA journal_mode = OFF') # written to a temporary file and renamed, so no journal is needed
+    cursor.execute('PRAGMA synchronous = OFF')
+    cursor.execute('CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL, '
+                   'organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)')
+    cursor.executemany('INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)',
+                       [('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+                        ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+                        ('WGS 84 geodetic', 4326, 'EPSG', 4326, WGS84_WKT, 'longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid')])
+    cursor.execute("CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, "
+                   "description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), "
+                   "min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER REFERENCES gpkg_spatial_ref_sys(srs_id))")
+    cursor.execute('CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, '
+                   'srs_id INTEGER NOT NULL REFERENCES gpkg_spatial_ref_sys(srs_id), z TINYINT NOT NULL, m TINYINT NOT NULL, '
+                   'PRIMARY KEY (table_name, column_name))')
+
+    for layer, data in layers.items():
+
+        columns = list(data.columns)
+        column_types = [GPKG_COLUMN_TYPES.get(data[column].dtype.kind, 'TEXT') for column in columns]
+        cursor.execute('CREATE TABLE "{0}" (fid INTEGER PRIMARY KEY AUTOINCREMENT, geom POINT, {1})'.format(layer, \
+                       ', '.join('"{0}" {1}'.format(column, column_type) for column, column_type in zip(columns, column_types))))
+
+        wkb, size, valid = point_wkb(data['LON'], data['LAT'], gpkg_header=True)
+        geometries = np.frombuffer(wkb, dtype='V{0}'.format(size)).astype(object) # one bytes value per point, in one numpy step
+        geometries[~valid] = None
+
+        cursor.executemany('INSERT INTO "{0}" (geom, {1}) VALUES (?, {2})'.format(layer, ', '.join('"{0}"'.format(column) for column in columns), \
+                           ', '.join('?' * len(columns))), zip(geometries.tolist(), *[_gpkg_values(data[column]) for column in columns]))
+
+        bounds = [data['LON'].min(), data['LAT'].min(), data['LON'].max(), data['LAT'].max()]
+        cursor.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, max_y, srs_id) VALUES (?, 'features', ?, ?, ?, ?, ?, 4326)",
+                       [layer, layer] + [None if pd.isna(value) else float(value) for value in bounds])
+        cursor.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', 'POINT', 4326, 0, 0)", [layer])
+
+    connection.commit()
+    connection.close()
+
+    os.replace(filename + '.tmp', filename) # write then rename so a half-written file is never opened
+
+    return(filename)
+
+
+#-----------------------------------------------
+# Function for writing a point layer to GeoParquet 1.0 (WKB geometry column, lon/lat WGS84 - the default CRS)
+#-----------------------------------------------
+
+def write_geoparquet(data, filename):
+
+    wkb, size, valid = point_wkb(data['LON'], data['LAT'])
+    validity = pa.array(valid).buffers()[1] # bitmap of the points with a position
+    geometry = pa.FixedSizeBinaryArray.from_buffers(pa.binary(size), len(data), [validity, pa.py_buffer(wkb)]).cast(pa.binary())
+
+    table = pa.Table.from_pandas(data, preserve_index=False).append_column('geometry', geometry)
+
+    geo = {'version': '1.0.0',
+           'primary_column': 'geometry',
+           'columns': {'geometry': {'encoding': 'WKB',
+                                    'geometry_types': ['Point'],
+                                    'bbox': [float(data['LON'].min()), float(data['LAT'].min()), float(data['LON'].max()), float(data['LAT'].max())]}}}
+    table = table.replace_schema_metadata(dict(table.schema.metadata or {}, geo=json.dumps(geo)))
+
+    pq.write_table(table, filename + '.tmp')
+    os.replace(filename + '.tmp', filename)
+
+    return(filename)
+
+
+#-----------------------------------------------
+# Function for exporting all days and data types of one airport (run in a worker process)
+# out_format is 'gpkg' (<airport>_<period>.gpkg, a layer per data type) or 'parquet' (<airport>_<layer>_<period>.parquet)
+# Returns the files written and the number of points in each layer
+#-----------------------------------------------
+
+def export_airport(file_path, out_path, airport, date_list, period, data_type_list=('AMDARS', 'MODE-S'), out_format='gpkg', cache_path=None):
+
+    layers = {}
+    for data_type in data_type_list:
+        data = load_airport_days(file_path, data_type, airport, date_list, cache_path)
+        if data is not None:
+            layers[LAYER_NAMES[data_type]] = data
+
+    if len(layers) == 0:
+        return([], {})
+
+    if out_format == 'gpkg':
+        filenames = [write_geopackage(layers, os.path.join(out_path, '{0}_{1}.gpkg'.format(airport, period)))]
+    elif out_format == 'parquet':
+        filenames = [write_geoparquet(data, os.path.join(out_path, '{0}_{1}_{2}.parquet'.format(airport, layer, period))) for layer, data in layers.items()]
+    else:
+        raise ValueError("out_format must be 'gpkg' or 'parquet'")
+
+    return(filenames, {layer: len(data) for layer, data in layers.items()})
+
+
+def main():
+
+    #---------------------------------------------------------------------
+    # 01. Settings
+    #---------------------------------------------------------------------
+
+    file_path = '/data/users/gdaron/Mode-S_altitude/MetDB_extract/'
+    out_path = '/data/users/gdaron/Mode-S_altitude/GIS_layers'
+    cache_path = '/data/users/gdaron/Mode-S_altitude/MetDB_cache' # Parquet cache of parsed extracts (set to None to always read the raw files)
+
+    out_format = 'gpkg' # 'gpkg' (GeoPackage, one file per airport) or 'parquet' (GeoParquet, one file per airport and data type)
+
+    n_workers = 4 # number of airports exported at the same time
+
+    log_level = 'INFO' # 'DEBUG' to log the layers of every airport
+
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+
+    period = 'winter' # summer or winter
+
+    if period == 'summer':
+        start_date = datetime.date(2021,7,10)
+        end_date = datetime.date(2021,8,10)
+
+    if period == 'winter':
+        start_date = datetime.date(2022,1,1)
+        end_date = datetime.date(2022,1,31)
+
+    date_list = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    date_list = [date_obj.strftime('%Y%m%d') for date_obj in date_list]
+
+    airport_name_list = ['Heathrow', \
+                         'Gatwick', \
+                         'Manchester', \
+                         'Stansted', \
+                         'Edinburgh', \
+                         'Birmingham', \
+                         'Bristol', \
+                         'Glasgow', \
+                         'Aberdeen', \
+                         'EastMidlands', \
+                         'LondonCity', \
+                         'BelfastInt', \
+                         'Newcastle', \
+                         'LeedsBradford', \
+                         'Liverpool',\
+                         'Cardiff']
+
+    setup_logging(log_level)
+
+    #---------------------------------------------------------------------
+    # 02. Export the layers of each airport (in n_workers processes)
+    #---------------------------------------------------------------------
+
+    tasks = [(file_path, out_path, airport, date_list, period, ('AMDARS', 'MODE-S'), out_format, cache_path) for airport in airport_name_list]
+
+    if n_workers == 1:
+        results = [export_airport(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(export_airport, *zip(*tasks)))
+
+    for airport, (filenames, counts) in zip(airport_name_list, results):
+        if len(filenames) == 0:
+            logger.warning('No extract files for %s', airport)
+            continue
+        logger.info('%s: %s written (%s)', airport, ', '.join(filenames), ', '.join('{0} {1} points'.format(layer, n) for layer, n in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+histogram_cube.py
+
+Histogram "cube" of the runway alignment results: the counts of abs_difference_min in each angle bin for
+every combination of airport, operator, phase and period, computed in one pass and saved as a table
+(one row per combination, one column per bin), so histograms for any selection can be made without
+rerunning filter_amdar_data.py
+
+Usage (from another script):
+   from histogram_cube import build_histogram_cube, save_histogram_cube, load_histogram_cube, select_histogram
+'''
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+ANGLE_BINS = [0,10,20,30,40,50,60,70,80,90]
+
+
+def bin_columns(bins):
+
+    return(['bin_{0}_{1}'.format(lo, hi) for lo, hi in zip(bins[:-1], bins[1:])])
+
+
+#-----------------------------------------------
+# Function for building the cube: counts of value_col in each bin, for each combination of the by columns
+# Bins are as np.histogram (closed on the left, the last bin also includes its right edge)
+# n_rows counts all rows of the combination, including those without a value (used to normalise the histograms)
+#-----------------------------------------------
+
+def build_histogram_cube(df, value_col, by, bins=ANGLE_BINS):
+
+    bins = np.asarray(bins)
+    n_bins = len(bins) - 1
+
+    grouped = df.groupby(by, sort=True, dropna=False) # rows without an operator are kept (as NaN)
+    group_codes = grouped.ngroup().to_numpy()
+    groups = grouped.size().index.to_frame(index=False)
+    n_groups = len(groups)
+
+    values = df[value_col].to_numpy(dtype=float)
+    bin_index = np.searchsorted(bins, values, side='right') - 1
+    bin_index[values == bins[-1]] = n_bins - 1 # right edge of the last bin is included
+    in_bins = ~np.isnan(values) & (bin_index >= 0) & (bin_index < n_bins)
+
+    counts = np.zeros((n_groups, n_bins), dtype=np.int64)
+    np.add.at(counts, (group_codes[in_bins], bin_index[in_bins]), 1)
+
+    cube = pd.concat([groups,
+                      pd.DataFrame({'n_rows': np.bincount(group_codes, minlength=n_groups)}),
+                      pd.DataFrame(counts, columns=bin_columns(bins))], axis=1)
+
+    return(cube)
+
+
+#-----------------------------------------------
+# Functions for saving/loading cubes (one CSV per phase and period, loaded together into one table)
+#-----------------------------------------------
+
+def save_histogram_cube(cube, out_path, phase, period):
+
+    filename = os.path.join(out_path, 'Hist_cube_{0}_{1}.csv'.format(phase, period))
+
+    cube.to_csv(filename, index=False, na_rep='NaN')
+
+    return(filename)
+
+
+def load_histogram_cube(out_path):
+
+    filenames = sorted(glob.glob(os.path.join(out_path, 'Hist_cube_*.csv')))
+
+    if len(filenames) == 0:
+        return -1
+
+    cube = pd.concat([pd.read_csv(filename, keep_default_na=False, na_values=['NaN']) for filename in filenames], ignore_index=True)
+
+    return(cube)
+
+
+#-----------------------------------------------
+# Function for the histogram of a selection (e.g. operator='BAW', phase='Ascent'), summed over everything else
+# Returns the counts in each bin, the number of rows (for fractions) and the bin edges
+#-----------------------------------------------
+
+def select_histogram(cube, **selection):
+
+    selected = cube
+    for column, value in selection.items():
+        selected = selected[selected[column] == value]
+
+    columns = [column for column in cube.columns if column.startswith('bin_')]
+    bins = [int(columns[0].split('_')[1])] + [int(column.split('_')[2]) for column in columns]
+
+    counts = selected[columns].sum(axis=0).to_numpy()
+    n_rows = int(selected['n_rows'].sum())
+
+    return(counts, n_rows, bins)
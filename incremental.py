@@ -0,0 +1,120 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+incremental.py
+
+Functions for incremental reprocessing: a manifest records which input files (by content hash) and which
+parameters produced each intermediate result (e.g. one airport/date), so unchanged results can be reused
+
+Usage (from another script):
+   from incremental import load_manifest, save_manifest, result_signature, is_up_to_date, load_result, save_result
+'''
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+
+#-----------------------------------------------
+# Functions for reading/writing the manifest (json file in the results directory)
+#-----------------------------------------------
+
+def load_manifest(incremental_path):
+
+    manifest_file = os.path.join(incremental_path, 'manifest.json')
+
+    if not os.path.isfile(manifest_file):
+        return({'hashes': {}, 'results': {}})
+
+    with open(manifest_file) as reader:
+        manifest = json.load(reader)
+
+    return(manifest)
+
+
+def save_manifest(manifest, incremental_path):
+
+    if not os.path.exists(incremental_path):
+        os.makedirs(incremental_path)
+
+    manifest_file = os.path.join(incremental_path, 'manifest.json')
+
+    with open(manifest_file + '.tmp', 'w') as writer:
+        json.dump(manifest, writer, indent=1)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
+#-----------------------------------------------
+# Function for the content hash of an input file
+# (the hash is remembered in the manifest with the mtime and size, so unchanged files are not read again)
+#-----------------------------------------------
+
+def file_hash(filename, manifest):
+
+    if not os.path.isfile(filename):
+        return None
+
+    stat = os.stat(filename)
+    known = manifest['hashes'].get(filename)
+    if known is not None and known[0] == stat.st_mtime_ns and known[1] == stat.st_size:
+        return(known[2])
+
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as reader:
+        for block in iter(lambda: reader.read(1 << 20), b''):
+            sha1.update(block)
+
+    manifest['hashes'][filename] = [stat.st_mtime_ns, stat.st_size, sha1.hexdigest()]
+
+    return(sha1.hexdigest())
+
+
+#-----------------------------------------------
+# Function for the signature of a result (hashes of its input files + the parameters used)
+#-----------------------------------------------
+
+def result_signature(manifest, input_files, params):
+
+    signature = {'inputs': {filename: file_hash(filename, manifest) for filename in input_files},
+                 'params': params}
+
+    return(signature)
+
+
+#-----------------------------------------------
+# Functions for checking, loading and saving an intermediate result
+#-----------------------------------------------
+
+def _result_filename(incremental_path, key):
+
+    return(os.path.join(incremental_path, '{0}.pkl'.format(key)))
+
+
+def is_up_to_date(manifest, incremental_path, key, signature):
+
+    if manifest['results'].get(key) != signature:
+        return False
+
+    return(os.path.isfile(_result_filename(incremental_path, key)))
+
+
+def load_result(incremental_path, key):
+
+    result = pd.read_pickle(_result_filename(incremental_path, key))
+
+    return(result)
+
+
+def save_result(manifest, incremental_path, key, signature, result):
+
+    if not os.path.exists(incremental_path):
+        os.makedirs(incremental_path)
+
+    result_file = _result_filename(incremental_path, key)
+    pd.to_pickle(result, result_file + '.tmp', compression=None) # any picklable result (e.g. a dataframe or a tuple of dataframes)
+    os.replace(result_file + '.tmp', result_file)
+
+    manifest['results'][key] = signature
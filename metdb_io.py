@@ -0,0 +1,366 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+metdb_io.py
+
+Shared loaders for the MetDB extracts (AMDARS and MODE-S airport-day files), with a columnar cache of the parsed data
+
+Usage (from another script):
+   from metdb_io import import_metdb_file
+'''
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+#-----------------------------------------------
+# Function for building the path of an extract file (<file_path>/<TYPE>/<airport>/<TYPE>_<date>.txt)
+#-----------------------------------------------
+
+def metdb_filename(file_path, data_type, airport, date):
+
+    filename = '{0}/{1}/{2}/{1}_{3}.txt'.format(file_path, data_type, airport, date)
+
+    return(filename)
+
+
+#-----------------------------------------------
+# Function for converting the MetDB TIME column (YYYYMMDDHHMMSS, seconds may be '--') to datetime64[s]
+# Splits the value into its fields with integer arithmetic (numeric column) or on the bytes of the
+# fixed-width strings (column with '--' seconds), instead of formatting strings and calling to_datetime
+#-----------------------------------------------
+
+def parse_metdb_time(time_col):
+
+    values = np.asarray(time_col)
+
+    if values.dtype.kind in 'iu': # all seconds present - pandas reads the column as integers
+        values = values.astype(np.int64)
+        year = values // 10**10
+        month = values // 10**8 % 100
+        day = values // 10**6 % 100
+        hour = values // 10**4 % 100
+        minute = values // 10**2 % 100
+        second = values % 100
+
+    else:
+        if values.dtype.kind == 'f': # integer column with missing values
+            if np.isnan(values).any():
+                raise ValueError('TIME column contains missing values')
+            values = values.astype(np.int64).astype(str)
+
+        digits = np.asarray(values, dtype='S15') # one spare byte to catch values that are too long
+        digits = digits.view(np.uint8).reshape(len(digits), 15)
+        if (digits[:, :14] == 0).any() or (digits[:, 14] != 0).any():
+            raise ValueError('TIME values must be 14 characters (YYYYMMDDHHMMSS)')
+        digits = digits[:, :14]
+
+        null_seconds = digits == ord('-') # replace null seconds with 00
+        digits = np.where(null_seconds, 0, digits.astype(np.int64) - ord('0'))
+        if null_seconds[:, :12].any() or (digits < 0).any() or (digits > 9).any():
+            raise ValueError('TIME values must be digits (YYYYMMDDHHMMSS, seconds may be --)')
+
+        year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+        month = digits[:, 4] * 10 + digits[:, 5]
+        day = digits[:, 6] * 10 + digits[:, 7]
+        hour = digits[:, 8] * 10 + digits[:, 9]
+        minute = digits[:, 10] * 10 + digits[:, 11]
+        second = digits[:, 12] * 10 + digits[:, 13]
+
+    if ((month < 1) | (month > 12) | (day < 1) | (day > 31) | (hour > 23) | (minute > 59) | (second > 59)).any():
+        raise ValueError('TIME values out of range (YYYYMMDDHHMMSS)')
+
+    months = (year - 1970) * 12 + (month - 1)
+    dates = months.astype('datetime64[M]').astype('datetime64[D]') + (day - 1)
+    if (dates.astype('datetime64[M]') != months.astype('datetime64[M]')).any():
+        raise ValueError('TIME values contain an invalid day of month')
+
+    times = dates.astype('datetime64[s]') + (hour * 3600 + minute * 60 + second).astype('timedelta64[s]')
+
+    return(times)
+
+
+#-----------------------------------------------
+# Schemas of the extract files (columns as in the HEADERS of fix_metdb_headers.py, plus FLGT_PHAS, which is
+# included in the AMDAR extracts used for the ascent/descent profiles)
+# Columns not listed are not read. LAT/LON stay float64 (float32 is only ~0.5 m at UK latitudes, and the
+# orientation/BNG calculations use the differences between positions). Altitudes (whole metres) and the
+# flight phase are small integers - float32 for files where the column has missing or fractional values
+#-----------------------------------------------
+
+METDB_SCHEMAS = {'AMDARS': {'RGSN_NMBR': 'identifier',
+                            'TIME': 'time',
+                            'LAT': 'float64',
+                            'LON': 'float64',
+                            'ALTD': 'int16',
+                            'FLGT_PHAS': 'int8'},
+                 'MODE-S': {'AIRCRAFT_NO': 'identifier',
+                            'TIME': 'time',
+                            'LAT': 'float64',
+                            'LON': 'float64',
+                            'PESR_ALTD': 'int16',
+                            'GNSS_ALTD': 'int16'}}
+
+LOADER_VERSION = 2 # bump when the parsed format changes, so older cached extracts are reparsed
+
+
+def _read_header(filename):
+
+    with open(filename) as reader:
+        for line in reader:
+            if line.strip():
+                return([column.strip() for column in line.split(',')])
+
+    return([])
+
+
+#-----------------------------------------------
+# Function for converting the raw identifiers (e.g. "b'EU0149  '") to a categorical of cleaned identifiers
+# Only the distinct values are cleaned; categories are sorted so that sorting by identifier stays alphabetical
+#-----------------------------------------------
+
+def identifier_categorical(values):
+
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object)) # missing values get code -1
+    cleaned = clean_identifier(pd.Series(uniques, dtype=object)).to_numpy(dtype=str)
+
+    # different raw values can clean to the same identifier (e.g. with and without trailing spaces)
+    categories, inverse = np.unique(cleaned, return_inverse=True)
+    codes = np.append(inverse.reshape(-1), -1)[codes] # code -1 stays -1
+
+    return(pd.Categorical.from_codes(codes, categories=categories))
+
+
+#-----------------------------------------------
+# Function for storing a numeric column as a small integer type if all values fit, otherwise as float32
+#-----------------------------------------------
+
+def small_integer(values, dtype):
+
+    info = np.iinfo(dtype)
+
+    if np.isfinite(values).all() and (values == np.round(values)).all() and (values >= info.min).all() and (values <= info.max).all():
+        return(values.astype(dtype))
+
+    return(values.astype(np.float32))
+
+
+#-----------------------------------------------
+# Function for reading and parsing a raw extract file (CSV)
+# data_type ('AMDARS' or 'MODE-S') selects the schema - if None, it is found from the first header column
+# The pyarrow CSV engine is used when installed (multi-threaded and lower peak memory), otherwise the C engine
+#-----------------------------------------------
+
+def _read_options(filename, data_type):
+
+    header = _read_header(filename)
+
+    if data_type is None:
+        data_type = 'AMDARS' if header[:1] == ['RGSN_NMBR'] else 'MODE-S'
+    schema = METDB_SCHEMAS[data_type]
+
+    usecols = [column for column in header if column in schema]
+    # TIME is left to the reader: integers when all seconds are present, strings when some are '--'
+    dtypes = {column: {'identifier': 'str', 'int8': 'float64', 'int16': 'float64'}.get(schema[column], schema[column]) \
+              for column in usecols if schema[column] != 'time'}
+
+    return(schema, usecols, dtypes)
+
+
+def _apply_schema(data, schema, usecols):
+
+    data = data[usecols] # pyarrow keeps the file order, the C engine may not
+
+    for column in usecols:
+        if schema[column] == 'identifier':
+            data[column] = identifier_categorical(data[column].to_numpy(dtype=object))
+        elif schema[column] in ('int8', 'int16'):
+            data[column] = small_integer(data[column].to_numpy(), schema[column])
+
+    data['TIME'] = parse_metdb_time(data['TIME'].to_numpy()) # null seconds ('--') are read as 00
+
+    data.set_index('TIME', inplace=True)
+
+    return(data)
+
+
+def parse_metdb_file(filename, data_type=None):
+
+    schema, usecols, dtypes = _read_options(filename, data_type)
+
+    try:
+        data = pd.read_csv(filename, usecols=usecols, dtype=dtypes, engine='pyarrow')
+    except (ImportError, ValueError):
+        data = pd.read_csv(filename, usecols=usecols, dtype=dtypes, float_precision='round_trip') # same values as pyarrow
+
+    data = _apply_schema(data, schema, usecols)
+
+    return(data)
+
+
+#-----------------------------------------------
+# Function for reading a raw extract file in chunks of chunksize rows (bounded memory for long periods)
+# Yields parsed chunks with the same columns/types as parse_metdb_file (nothing if the file does not exist)
+#-----------------------------------------------
+
+def iter_metdb_chunks(filename, data_type=None, chunksize=200000):
+
+    if not os.path.isfile(filename):
+        return
+
+    schema, usecols, dtypes = _read_options(filename, data_type)
+
+    with pd.read_csv(filename, usecols=usecols, dtype=dtypes, chunksize=chunksize, float_precision='round_trip') as reader: # C engine (pyarrow cannot read in chunks)
+        for data in reader:
+            yield _apply_schema(data, schema, usecols)
+
+
+#-----------------------------------------------
+# Function for concatenating parsed extracts (e.g. the days of a month) without losing the categorical identifiers
+# (pd.concat falls back to object strings when the categories of the frames differ)
+#-----------------------------------------------
+
+def concat_metdb_frames(frames):
+
+    frames = list(frames)
+
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            categories = np.unique(np.concatenate([np.asarray(frame[column].cat.categories, dtype=str) for frame in frames]))
+            frames = [frame.assign(**{column: frame[column].cat.set_categories(categories)}) for frame in frames]
+
+    data = pd.concat(frames)
+
+    return(data)
+
+
+#-----------------------------------------------
+# Functions for the columnar (Parquet) cache of parsed extracts (or pickle, for files ending in .pkl)
+# The cache is valid while the source file has the same mtime and size as when the cache was written
+#-----------------------------------------------
+
+def source_signature(filename):
+
+    stat = os.stat(filename)
+
+    return({'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'loader_version': LOADER_VERSION})
+
+
+def _cache_filename(cache_path, data_type, airport, date):
+
+    cache_file = '{0}/{1}/{2}/{1}_{3}.parquet'.format(cache_path, data_type, airport, date)
+
+    return(cache_file)
+
+
+def read_snapshot(cache_file, filename):
+
+    signature_file = cache_file + '.json'
+
+    if not (os.path.isfile(cache_file) and os.path.isfile(signature_file)):
+        return None
+
+    with open(signature_file) as reader:
+        signature = json.load(reader)
+
+    if signature != source_signature(filename): # source has changed since the cache was written
+        return None
+
+    try:
+        if cache_file.endswith('.pkl'):
+            data = pd.read_pickle(cache_file)
+        else:
+            data = pd.read_parquet(cache_file)
+    except (ImportError, OSError, ValueError):
+        return None # unreadable cache (or no parquet engine) - reparse the source
+
+    return(data)
+
+
+def write_snapshot(data, cache_file, signature):
+
+    signature_file = cache_file + '.json'
+
+    cache_dir = os.path.dirname(cache_file)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    try:
+        if cache_file.endswith('.pkl'):
+            data.to_pickle(cache_file + '.tmp', compression=None)
+        else:
+            data.to_parquet(cache_file + '.tmp')
+    except (ImportError, ValueError, TypeError):
+        return # no parquet engine (pyarrow/fastparquet) installed, or columns parquet can't store - run without the cache
+
+    os.replace(cache_file + '.tmp', cache_file) # write then rename so a half-written file is never read
+
+    with open(signature_file + '.tmp', 'w') as writer:
+        json.dump(signature, writer)
+    os.replace(signature_file + '.tmp', signature_file)
+
+
+#-----------------------------------------------
+# Function for importing an AMDARS or MODE-S airport-day file (returns -1 if the file does not exist)
+# Columns are typed by METDB_SCHEMAS (cleaned categorical identifiers, small integer altitudes)
+# If cache_path is set, the parsed data is read from/written to the Parquet cache
+#-----------------------------------------------
+
+def import_metdb_file(file_path, data_type, airport, date, cache_path=None):
+
+    filename = metdb_filename(file_path, data_type, airport, date)
+
+    if not os.path.isfile(filename):
+        return -1
+
+    if cache_path is not None:
+        data = read_snapshot(_cache_filename(cache_path, data_type, airport, date), filename)
+        if data is not None:
+            return(data)
+
+    signature = source_signature(filename) # taken before parsing so a file changed mid-read is not cached as current
+
+    data = parse_metdb_file(filename, data_type)
+
+    if cache_path is not None:
+        write_snapshot(data, _cache_filename(cache_path, data_type, airport, date), signature)
+
+    return(data)
+
+
+#-----------------------------------------------
+# Function for reading an Excel sheet via a binary snapshot (refreshed only when the .xlsx changes)
+# Pickle rather than Parquet, as spreadsheet columns often mix numbers and text
+#-----------------------------------------------
+
+def read_excel_snapshot(filename, sheet_name, snapshot_file=None):
+
+    if snapshot_file is None:
+        snapshot_file = '{0}.{1}.pkl'.format(os.path.splitext(filename)[0], sheet_name)
+
+    data = read_snapshot(snapshot_file, filename)
+    if data is not None:
+        return(data)
+
+    signature = source_signature(filename)
+
+    data = pd.read_excel(filename, sheet_name=sheet_name)
+
+    write_snapshot(data, snapshot_file, signature)
+
+    return(data)
+
+
+#-----------------------------------------------
+# Function for removing the byte-string wrapper from MetDB identifiers (e.g. "b'EU0149  '" -> "EU0149")
+#-----------------------------------------------
+
+def clean_identifier(series):
+
+    cleaned = series.astype(str).str.replace(r"^b'(.*)'$", r"\1", regex=True).str.strip()
+
+    return(cleaned)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+observation_matching.py
+
+Code for pairing individual AMDAR and Mode-S reports, so pressure altitude biases can be computed over matched
+pairs rather than from daily minimums. Each AMDAR report is matched to a Mode-S report within time_tolerance:
+ - by aircraft identity where the AMDAR identifier is linked to a Mode-S aircraft address (id_links table),
+   with a sorted merge_asof join on time per aircraft
+ - otherwise (or if the linked aircraft has no report close enough) to the nearest Mode-S report in space
+Both kinds of match must be within max_distance (WGS84 geodesic distance)
+
+To run the code:
+   ./observation_matching.py
+
+Usage (from another script):
+   from observation_matching import match_observations, altitude_bias
+'''
+
+import datetime
+import logging
+import os
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from geo_tools import GEODESIC
+from metdb_io import import_metdb_file, concat_metdb_frames, clean_identifier
+from run_report import new_run_report, timed_stage, add_stage, write_run_report, setup_logging
+
+logger = logging.getLogger('observation_matching')
+
+EARTH_RADIUS = 6371000.0 # m, only used for the candidate pre-selection (matches use the geodesic distance)
+
+
+#-----------------------------------------------
+# Function for the nearest Mode-S report (in space) to each AMDAR report, among the Mode-S reports within
+# the time tolerance. Mode-S times must be sorted. The candidate pairs of each time window are pre-selected
+# with a flat-earth distance (1% margin) and the nearest is chosen by geodesic distance
+# Returns the index of the matched Mode-S report (-1 if none within max_distance) and the distance
+#-----------------------------------------------
+
+def _nearest_in_time_window(amdar_time, amdar_lat, amdar_lon, modes_time, modes_lat, modes_lon, time_tolerance, max_distance, chunk_size=20000):
+
+    matched = np.full(len(amdar_time), -1)
+    distance = np.full(len(amdar_time), np.nan)
+
+    lo = np.searchsorted(modes_time, amdar_time - time_tolerance, side='left')
+    hi = np.searchsorted(modes_time, amdar_time + time_tolerance, side='right')
+
+    max_angle = np.degrees(max_distance * 1.01 / EARTH_RADIUS)
+
+    for start in range(0, len(amdar_time), chunk_size): # chunks bound the number of candidate pairs in memory
+
+        rows = np.arange(start, min(start + chunk_size, len(amdar_time)))
+        counts = hi[rows] - lo[rows]
+
+        pair_row = np.repeat(rows, counts)
+        pair_modes = np.repeat(lo[rows], counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+
+        dlat = modes_lat[pair_modes] - amdar_lat[pair_row]
+        dlon = (modes_lon[pair_modes] - amdar_lon[pair_row]) * np.cos(np.radians(amdar_lat[pair_row]))
+        close = dlat**2 + dlon**2 <= max_angle**2
+        pair_row, pair_modes = pair_row[close], pair_modes[close]
+
+        if len(pair_row) == 0:
+            continue
+
+        _, _, pair_distance = GEODESIC.inv(amdar_lon[pair_row], amdar_lat[pair_row], modes_lon[pair_modes], modes_lat[pair_modes])
+        pair_distance = np.asarray(pair_distance)
+
+        order = np.lexsort((pair_distance, pair_row)) # nearest first for each AMDAR report
+        first = order[np.unique(pair_row[order], return_index=True)[1]]
+        first = first[pair_distance[first] <= max_distance]
+
+        matched[pair_row[first]] = pair_modes[first]
+        distance[pair_row[first]] = pair_distance[first]
+
+    return(matched, distance)
+
+
+#-----------------------------------------------
+# Function for matching AMDAR and Mode-S reports (dataframes indexed by TIME, as returned by import_metdb_file)
+# id_links (optional) has RGSN_NMBR and AIRCRAFT_NO columns linking AMDAR identifiers to Mode-S addresses
+# by (optional) is a column, e.g. airport, that matched reports must share
+# Returns one row per matched AMDAR report: the AMDAR and Mode-S columns (TIME/LAT/LON with suffixes _amdar/_modes), the time
+# difference (s), distance (m), match type ('identity' or 'nearest') and the altitude difference (Mode-S - AMDAR)
+#-----------------------------------------------
+
+def match_observations(amdar, modes, time_tolerance='10s', max_distance=1000, id_links=None, by=None, amdar_altd='ALTD', modes_altd='PESR_ALTD'):
+
+    time_tolerance = pd.Timedelta(time_tolerance)
+
+    amdar = amdar.reset_index()
+    amdar['_row'] = np.arange(len(amdar)) # to drop the reports matched by identity from the nearest neighbour step
+    modes = modes.reset_index()
+    amdar = amdar[amdar['LAT'].notna() & amdar['LON'].notna()].astype({'TIME': 'datetime64[s]'}) # same time unit for the joins
+    modes = modes[modes['LAT'].notna() & modes['LON'].notna()].astype({'TIME': 'datetime64[s]'})
+
+    amdar['RGSN_NMBR'] = amdar['RGSN_NMBR'].astype(str)
+    modes['AIRCRAFT_NO'] = modes['AIRCRAFT_NO'].astype(str)
+
+    matches = []
+
+    # 1. Aircraft identity: nearest report in time of the linked Mode-S aircraft (merge_asof on sorted times)
+    if id_links is not None and len(amdar) > 0:
+        links = id_links[['RGSN_NMBR', 'AIRCRAFT_NO']].astype(str).drop_duplicates(subset='RGSN_NMBR', keep='first')
+        linked = amdar.merge(links, on='RGSN_NMBR', how='inner').sort_values('TIME', kind='mergesort')
+
+        by_cols = ['AIRCRAFT_NO'] + ([] if by is None else [by])
+        right = modes.rename(columns={'TIME': 'TIME_modes'}).sort_values('TIME_modes', kind='mergesort')
+        identity = pd.merge_asof(linked, right, left_on='TIME', right_on='TIME_modes', by=by_cols, direction='nearest', tolerance=time_tolerance, suffixes=('_amdar', '_modes'))
+        identity = identity[identity['TIME_modes'].notna()].rename(columns={'TIME': 'TIME_amdar'})
+
+        _, _, distance = GEODESIC.inv(identity['LON_amdar'].to_numpy(), identity['LAT_amdar'].to_numpy(), identity['LON_modes'].to_numpy(), identity['LAT_modes'].to_numpy())
+        identity = identity.assign(distance=np.asarray(distance), match='identity')
+        identity = identity[identity['distance'] <= max_distance]
+
+        matches.append(identity)
+        amdar = amdar[~amdar['_row'].isin(identity['_row'])]
+
+    # 2. Nearest Mode-S report in space, within the time tolerance (for each group of the by column)
+    groups = [(amdar, modes)] if by is None else [(group, modes[modes[by] == value]) for value, group in amdar.groupby(by, sort=False)]
+
+    for amdar_group, modes_group in groups:
+
+        modes_group = modes_group.sort_values('TIME', kind='mergesort')
+
+        matched, distance = _nearest_in_time_window(amdar_group['TIME'].to_numpy().astype(np.int64), amdar_group['LAT'].to_numpy(float), amdar_group['LON'].to_numpy(float), \
+                                                    modes_group['TIME'].to_numpy().astype(np.int64), modes_group['LAT'].to_numpy(float), modes_group['LON'].to_numpy(float), \
+                                                    time_tolerance.total_seconds(), max_distance)
+        found = matched >= 0
+
+        left = amdar_group[found].reset_index(drop=True).rename(columns={column: column + '_amdar' for column in ['TIME', 'LAT', 'LON']})
+        right = modes_group.iloc[matched[found]].reset_index(drop=True).rename(columns={column: column + '_modes' for column in ['TIME', 'LAT', 'LON']})
+        if by is not None:
+            right = right.drop(columns=by)
+
+        matches.append(pd.concat([left, right], axis=1).assign(distance=distance[found], match='nearest'))
+
+    matches = pd.concat(matches, ignore_index=True).drop(columns='_row')
+
+    columns = [column for column in matches.columns if column != 'TIME_modes'] # Mode-S columns start with its time
+    columns.insert(columns.index('AIRCRAFT_NO'), 'TIME_modes')
+    matches = matches[columns]
+
+    matches['time_diff'] = (matches['TIME_modes'] - matches['TIME_amdar']).dt.total_seconds()
+    matches['altd_diff'] = matches[modes_altd].astype(float) - matches[amdar_altd].astype(float)
+
+    matches = matches.sort_values(['TIME_amdar', 'RGSN_NMBR'], kind='mergesort').reset_index(drop=True)
+
+    return(matches)
+
+
+#-----------------------------------------------
+# Function for the altitude bias (Mode-S - AMDAR) over the matched pairs, optionally for each group of the by column(s)
+#-----------------------------------------------
+
+def altitude_bias(matches, by=None):
+
+    grouped = matches.groupby(by, sort=True)['altd_diff'] if by is not None else matches['altd_diff']
+
+    bias = grouped.agg(['count', 'mean', 'median', 'std'])
+
+    return(bias)
+
+
+def main():
+
+    #---------------------------------------------------------------------
+    # 01. Settings
+    #---------------------------------------------------------------------
+
+    file_path = '/data/users/gdaron/Mode-S_altitude/MetDB_extract/'
+    out_path = '/data/users/gdaron/Mode-S_altitude/Mode-S_vs_AMDAR/matched'
+    cache_path = '/data/users/gdaron/Mode-S_altitude/MetDB_cache' # Parquet cache of parsed extracts (set to None to always read the raw files)
+
+    file_id_links = None # csv with RGSN_NMBR and AIRCRAFT_NO columns linking AMDAR identifiers to Mode-S addresses (None to match by position only)
+
+    time_tolerance = '10s' # largest time difference between matched reports
+    max_distance = 1000 # m, largest distance between matched reports
+
+    log_level = 'INFO' # 'DEBUG' to log every airport
+
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+
+    period = 'winter' # summer or winter
+
+    if period == 'summer':
+        start_date = datetime.date(2021,7,10)
+        end_date = datetime.date(2021,8,10)
+
+    if period == 'winter':
+        start_date = datetime.date(2022,1,1)
+        end_date = datetime.date(2022,1,31)
+
+    date_list = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    date_list = [date_obj.strftime('%Y%m%d') for date_obj in date_list]
+
+    airport_name_list = ['Heathrow', \
+                         'Gatwick', \
+                         'Manchester', \
+                         'Stansted', \
+                         'Edinburgh', \
+                         'Birmingham', \
+                         'Bristol', \
+                         'Glasgow', \
+                         'Aberdeen', \
+                         'EastMidlands', \
+                         'LondonCity', \
+                         'BelfastInt', \
+                         'Newcastle', \
+                         'LeedsBradford', \
+                         'Liverpool',\
+                         'Cardiff']
+
+    setup_logging(log_level)
+
+    report = new_run_report('observation_matching', {'period': period, 'time_tolerance': time_tolerance, 'max_distance': max_distance, 'airports': airport_name_list})
+
+    id_links = None
+    if file_id_links is not None:
+        id_links = pd.read_csv(file_id_links, dtype=str)
+        id_links['RGSN_NMBR'] = clean_identifier(id_links['RGSN_NMBR'])
+        id_links['AIRCRAFT_NO'] = clean_identifier(id_links['AIRCRAFT_NO'])
+
+    #---------------------------------------------------------------------
+    # 02. Match the AMDAR and Mode-S reports of each airport (all days at once)
+    #---------------------------------------------------------------------
+
+    match_frames = []
+
+    for airport in airport_name_list:
+
+        with timed_stage(report, 'load'):
+            amdar_frames = [import_metdb_file(file_path, 'AMDARS', airport, date, cache_path) for date in date_list]
+            modes_frames = [import_metdb_file(file_path, 'MODE-S', airport, date, cache_path) for date in date_list]
+            amdar_frames = [frame for frame in amdar_frames if type(frame) != int] # no file for this airport/date
+            modes_frames = [frame for frame in modes_frames if type(frame) != int]
+
+        if len(amdar_frames) == 0 or len(modes_frames) == 0:
+            logger.warning('No AMDAR or Mode-S files for %s', airport)
+            continue
+
+        data_amdar = concat_metdb_frames(amdar_frames)
+        data_modes = concat_metdb_frames(modes_frames)
+        add_stage(report, 'load', rows_out=len(data_amdar) + len(data_modes))
+
+        with timed_stage(report, 'match', rows_in=len(data_amdar)):
+            matches = match_observations(data_amdar, data_modes, time_tolerance, max_distance, id_links)
+        add_stage(report, 'match', rows_out=len(matches))
+
+        logger.debug('%s: %d of %d AMDAR reports matched', airport, len(matches), len(data_amdar))
+
+        matches.insert(0, 'Airport', airport)
+        match_frames.append(matches)
+
+    if len(match_frames) == 0:
+        return
+
+    #---------------------------------------------------------------------
+    # 03. Export the matched pairs and the altitude bias of each airport
+    #---------------------------------------------------------------------
+
+    with timed_stage(report, 'export'):
+        all_matches = pd.concat(match_frames, ignore_index=True)
+        all_matches.to_csv(os.path.join(out_path, 'Matched_reports_{0}.csv'.format(period)), index=False, na_rep='NaN')
+
+        bias = altitude_bias(all_matches, ['Airport', 'match'])
+        bias.to_csv(os.path.join(out_path, 'Matched_altitude_bias_{0}.csv'.format(period)))
+
+    logger.info('Altitude bias (Mode-S - AMDAR) over matched reports:\n%s', altitude_bias(all_matches, 'Airport'))
+
+    write_run_report(report, out_path)
+
+
+if __name__ == '__main__':
+    main()
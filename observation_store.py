@@ -0,0 +1,340 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+observation_store.py
+
+Consolidated store of the MetDB extracts: the AMDARS/MODE-S airport-day files are parsed once (with the
+schemas of metdb_io.py) and written to Hive-style partitioned Parquet
+(<store_path>/data_type=<TYPE>/airport=<airport>/date=<YYYYMMDD>/part-0.parquet), with a query API that
+pushes the airport/date selection down to the partitions and the bounding box, altitude ceiling and flight
+phase down to the Parquet row groups, so only matching data is read. Each partition is written sorted by
+altitude (row groups then cover narrow altitude ranges, and the low rows near the airport a small area), with
+the row number of the extract so queries return the rows in file order
+
+Usage (from another script):
+   from observation_store import query_observations, import_store_day, store_filename
+
+To build/update the store:
+   ./observation_store.py
+'''
+
+import datetime
+import json
+import logging
+import os
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from metdb_io import METDB_SCHEMAS, metdb_filename, import_metdb_file, small_integer, source_signature
+from run_report import setup_logging
+
+logger = logging.getLogger('observation_store')
+
+# Parquet types of the schema columns. Small integer columns are stored as float32 (exact for int8/int16, and
+# days with missing values need no other type); they are converted back with small_integer when queried
+STORE_TYPES = {'identifier': pa.string(),
+               'time': pa.timestamp('s'),
+               'float64': pa.float64(),
+               'int8': pa.float32(),
+               'int16': pa.float32()}
+
+STORE_PARTITIONING = ds.partitioning(pa.schema([('airport', pa.string()), ('date', pa.string())]), flavor='hive')
+
+ALTITUDE_COLUMNS = {'AMDARS': 'ALTD', 'MODE-S': 'PESR_ALTD'} # column used for the altitude ceiling by default
+
+ROW_GROUP_SIZE = 10000 # small enough for the row group statistics to skip most of an airport-day
+
+ROW_COLUMN = '_row' # row number in the extract (partitions are sorted by altitude, queries restore file order)
+
+STORE_VERSION = 2 # bump when the partition layout changes, so existing partitions are rewritten
+
+
+#-----------------------------------------------
+# Functions for the paths of the store (one directory per data type, one file per airport-day partition)
+#-----------------------------------------------
+
+def store_type_path(store_path, data_type):
+
+    return('{0}/data_type={1}'.format(store_path, data_type))
+
+
+def store_filename(store_path, data_type, airport, date):
+
+    filename = '{0}/airport={1}/date={2}/part-0.parquet'.format(store_type_path(store_path, data_type), airport, date)
+
+    return(filename)
+
+
+def store_schema(data_type):
+
+    return(pa.schema([(column, STORE_TYPES[kind]) for column, kind in METDB_SCHEMAS[data_type].items()] + [(ROW_COLUMN, pa.uint32())]))
+
+
+def store_signature(filename):
+
+    return(dict(source_signature(filename), store_version=STORE_VERSION))
+
+
+#-----------------------------------------------
+# Function for writing one airport-day partition from a parsed extract (as returned by import_metdb_file)
+# Rows are sorted by altitude, so the row group min/max statistics of the altitude ceiling (and of the bounding
+# box, as low rows are near the airport) let queries skip most row groups
+# A sidecar JSON holds the signature of the source file, so unchanged partitions are not rewritten
+#-----------------------------------------------
+
+def write_store_partition(data, part_file, data_type, signature):
+
+    schema = store_schema(data_type)
+
+    data = data.reset_index()
+    columns = {}
+    for field in schema:
+        if field.name == ROW_COLUMN:
+            columns[field.name] = pa.array(np.arange(len(data), dtype=np.uint32))
+        elif field.name not in data.columns: # e.g. FLGT_PHAS missing from a file
+            columns[field.name] = pa.nulls(len(data), field.type)
+        elif pa.types.is_string(field.type):
+            columns[field.name] = pa.array(data[field.name].astype(object).where(data[field.name].notna(), None), type=field.type)
+        else:
+            columns[field.name] = pa.array(data[field.name].to_numpy(), type=field.type, from_pandas=True)
+
+    table = pa.table(columns, schema=schema).sort_by([(ALTITUDE_COLUMNS[data_type], 'ascending'), (ROW_COLUMN, 'ascending')]) # missing altitudes last
+
+    part_dir = os.path.dirname(part_file)
+    if not os.path.exists(part_dir):
+        os.makedirs(part_dir, exist_ok=True)
+
+    pq.write_table(table, part_file + '.tmp', row_group_size=ROW_GROUP_SIZE)
+    os.replace(part_file + '.tmp', part_file) # write then rename so a half-written file is never read
+
+    with open(part_file + '.json.tmp', 'w') as writer:
+        json.dump(signature, writer)
+    os.replace(part_file + '.json.tmp', part_file + '.json')
+
+
+def _partition_is_current(part_file, filename):
+
+    signature_file = part_file + '.json'
+
+    if not (os.path.isfile(part_file) and os.path.isfile(signature_file)):
+        return False
+
+    with open(signature_file) as reader:
+        signature = json.load(reader)
+
+    return(signature == store_signature(filename))
+
+
+#-----------------------------------------------
+# Function for building/updating the store from the raw extracts of the given airports and dates
+# Only partitions whose source file is new or has changed are (re)written. Returns the number of partitions
+# written, reused (unchanged) and missing (no extract file)
+#-----------------------------------------------
+
+def build_observation_store(file_path, store_path, data_type, airport_list, date_list, cache_path=None):
+
+    counts = {'written': 0, 'reused': 0, 'missing': 0}
+
+    for airport in airport_list:
+        for date in date_list:
+
+            filename = metdb_filename(file_path, data_type, airport, date)
+            part_file = store_filename(store_path, data_type, airport, date)
+
+            if not os.path.isfile(filename):
+                counts['missing'] += 1
+                continue
+
+            if _partition_is_current(part_file, filename):
+                counts['reused'] += 1
+                continue
+
+            logger.debug('Adding to the store: %s %s %s', data_type, airport, date)
+
+            signature = store_signature(filename) # taken before parsing so a file changed mid-read is not marked as current
+            data = import_metdb_file(file_path, data_type, airport, date, cache_path)
+
+            write_store_partition(data, part_file, data_type, signature)
+            counts['written'] += 1
+
+    return(counts)
+
+
+#-----------------------------------------------
+# Function for the row filter of a query (applied to the Parquet row group statistics, then to the rows)
+# bbox is (lon_min, lat_min, lon_max, lat_max), max_altd keeps altitude < max_altd (as the ALTD < 1000 cut)
+#-----------------------------------------------
+
+def _row_filter(data_type, bbox=None, max_altd=None, altd_column=None, flight_phase=None):
+
+    conditions = []
+
+    if bbox is not None:
+        lon_min, lat_min, lon_max, lat_max = bbox
+        conditions += [ds.field('LON') >= lon_min, ds.field('LON') <= lon_max, ds.field('LAT') >= lat_min, ds.field('LAT') <= lat_max]
+
+    if max_altd is not None:
+        conditions.append(ds.field(altd_column or ALTITUDE_COLUMNS[data_type]) < max_altd)
+
+    if flight_phase is not None:
+        if 'FLGT_PHAS' not in METDB_SCHEMAS[data_type]:
+            raise ValueError('{0} observations have no flight phase'.format(data_type))
+        phases = [flight_phase] if np.isscalar(flight_phase) else list(flight_phase)
+        conditions.append(ds.field('FLGT_PHAS').isin(phases))
+
+    if len(conditions) == 0:
+        return None
+
+    row_filter = conditions[0]
+    for condition in conditions[1:]:
+        row_filter = row_filter & condition
+
+    return(row_filter)
+
+
+#-----------------------------------------------
+# Function for converting a query result back to the layout of import_metdb_file (indexed by TIME,
+# categorical identifiers, small integer altitudes), with the rows in airport/date/file order
+#-----------------------------------------------
+
+def _to_metdb_frame(table, data_type, with_partitions=False):
+
+    schema = METDB_SCHEMAS[data_type]
+
+    table = table.sort_by([('airport', 'ascending'), ('date', 'ascending'), (ROW_COLUMN, 'ascending')])
+    table = table.drop_columns([ROW_COLUMN] + ([] if with_partitions else ['airport', 'date']))
+
+    data = table.to_pandas()
+
+    for column in data.columns:
+        if schema.get(column) == 'identifier':
+            data[column] = pd.Categorical(data[column].to_numpy(dtype=object)) # sorted categories, as identifier_categorical
+        elif schema.get(column) in ('int8', 'int16'):
+            data[column] = small_integer(data[column].to_numpy(), schema[column])
+
+    data['TIME'] = data['TIME'].to_numpy().astype('datetime64[s]')
+    data.set_index('TIME', inplace=True)
+
+    return(data)
+
+
+#-----------------------------------------------
+# Function for querying the store: observations of one data type for a list of airports (None for all), a date
+# range (YYYYMMDD strings, inclusive), a bounding box, an altitude ceiling and a flight phase (AMDARS only,
+# e.g. 5 for Ascent). Partitions outside the airports/dates are not opened, the other predicates are pushed down
+# to the row groups. Returns -1 if no partition matches, otherwise the rows in airport/date/file order, with
+# airport and date columns if with_partitions
+#-----------------------------------------------
+
+def query_observations(store_path, data_type, airports=None, start_date=None, end_date=None, bbox=None, \
+                       max_altd=None, altd_column=None, flight_phase=None, columns=None, with_partitions=False):
+
+    type_path = store_type_path(store_path, data_type)
+
+    if not os.path.isdir(type_path):
+        return -1
+
+    part_files = []
+    for airport_dir in sorted(os.listdir(type_path)):
+        airport = airport_dir.split('=', 1)[-1]
+        if airports is not None and airport not in airports:
+            continue
+        for date_dir in sorted(os.listdir(os.path.join(type_path, airport_dir))):
+            date = date_dir.split('=', 1)[-1]
+            if (start_date is not None and date < start_date) or (end_date is not None and date > end_date):
+                continue
+            part_file = os.path.join(type_path, airport_dir, date_dir, 'part-0.parquet')
+            if os.path.isfile(part_file):
+                part_files.append(part_file)
+
+    if len(part_files) == 0:
+        return -1
+
+    dataset = ds.dataset(part_files, schema=store_schema(data_type).append(pa.field('airport', pa.string())).append(pa.field('date', pa.string())), \
+                         format='parquet', partitioning=STORE_PARTITIONING, partition_base_dir=type_path)
+
+    read_columns = list(METDB_SCHEMAS[data_type]) if columns is None else ['TIME'] + [column for column in columns if column != 'TIME']
+    read_columns += [ROW_COLUMN, 'airport', 'date'] # for the file order (airport/date are dropped unless with_partitions)
+
+    table = dataset.to_table(columns=read_columns, filter=_row_filter(data_type, bbox, max_altd, altd_column, flight_phase))
+
+    data = _to_metdb_frame(table, data_type, with_partitions)
+
+    return(data)
+
+
+#-----------------------------------------------
+# Function for reading one airport-day from the store, as import_metdb_file (returns -1 if the partition does not exist)
+# Any query predicates (bbox, max_altd, flight_phase, columns) are pushed down as in query_observations
+#-----------------------------------------------
+
+def import_store_day(store_path, data_type, airport, date, **predicates):
+
+    if not os.path.isfile(store_filename(store_path, data_type, airport, date)):
+        return -1
+
+    data = query_observations(store_path, data_type, [airport], date, date, **predicates)
+
+    return(data)
+
+
+def main():
+
+    #---------------------------------------------------------------------
+    # 01. Settings
+    #---------------------------------------------------------------------
+
+    store_path = '/data/users/gdaron/MetDB/store' # set as store_path in the processing scripts to read from the store
+    cache_path = None # Parquet cache of parsed extracts (the store replaces it, so not needed here)
+
+    # Extract directories, with the data types and periods in each (runway study and Mode-S/AMDAR comparison extracts)
+    source_list = [('/data/users/gdaron/MetDB/', ['AMDARS'], [(datetime.date(2013,7,22), datetime.date(2013,7,28)), \
+                                                              (datetime.date(2018,7,22), datetime.date(2018,7,28)), \
+                                                              (datetime.date(2020,7,22), datetime.date(2020,7,28)), \
+                                                              (datetime.date(2022,11,22), datetime.date(2022,11,28))]), \
+                   ('/data/users/gdaron/Mode-S_altitude/MetDB_extract/', ['AMDARS', 'MODE-S'], [(datetime.date(2021,7,10), datetime.date(2021,8,10)), \
+                                                                                                 (datetime.date(2022,1,1), datetime.date(2022,1,31))])]
+
+    airport_name_list = ['Heathrow', \
+                         'Gatwick', \
+                         'Manchester', \
+                         'Stansted', \
+                         'Edinburgh', \
+                         'Birmingham', \
+                         'Bristol', \
+                         'Glasgow', \
+                         'Aberdeen', \
+                         'EastMidlands', \
+                         'LondonCity', \
+                         'BelfastInt', \
+                         'Newcastle', \
+                         'LeedsBradford', \
+                         'Liverpool',\
+                         'Cardiff']
+
+    log_level = 'INFO' # 'DEBUG' to log every partition written
+
+    setup_logging(log_level)
+
+    #---------------------------------------------------------------------
+    # 02. Add new/changed airport-day extracts to the store
+    #---------------------------------------------------------------------
+
+    for file_path, data_type_list, period_list in source_list:
+
+        date_list = [(start_date + timedelta(days=i)).strftime('%Y%m%d') for start_date, end_date in period_list \
+                     for i in range((end_date - start_date).days + 1)]
+
+        for data_type in data_type_list:
+            counts = build_observation_store(file_path, store_path, data_type, airport_name_list, date_list, cache_path)
+            logger.info('%s %s: %d partitions written, %d unchanged, %d extracts missing', file_path, data_type, counts['written'], counts['reused'], counts['missing'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+plotting.py
+
+Headless batch rendering of the report figures: the scripts build a list of figure specs (dicts with the
+data and labels of each figure), which are then drawn with the non-interactive Agg backend, in a pool of
+worker processes if n_workers > 1. Figure generation can be switched off for compute-only runs.
+
+Usage (from another script):
+   from plotting import histogram_spec, timeseries_spec, render_figures
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg') # no display needed (batch jobs, worker processes)
+import matplotlib.pyplot as plt
+from matplotlib import dates
+from matplotlib.ticker import PercentFormatter
+import numpy as np
+
+
+#-----------------------------------------------
+# Function for the spec of a histogram of angle differences from binned counts (e.g. from the histogram cube)
+# Bars show the fraction of all n_rows profiles in each bin
+#-----------------------------------------------
+
+def histogram_spec(filename, counts, n_rows, bins, title):
+
+    counts = np.asarray(counts, dtype=float)
+
+    spec = {'kind': 'histogram',
+            'filename': filename,
+            'counts': counts,
+            'n_rows': n_rows,
+            'bins': list(bins),
+            'title': title,
+            'annotation': 'No. of profiles: ' + str(int(counts.sum()))}
+
+    return(spec)
+
+
+#-----------------------------------------------
+# Function for the spec of a time series plot of altitudes
+# lines is a list of (series, style) - series indexed by time, style holds the plot keywords (label, color, ...)
+#-----------------------------------------------
+
+def timeseries_spec(filename, lines, title, xlim, ylim, xticks=None, ylabel='Altitude / m'):
+
+    spec = {'kind': 'timeseries',
+            'filename': filename,
+            'lines': [(series.index.to_numpy(), series.to_numpy(), dict(style)) for series, style in lines],
+            'title': title,
+            'xlim': xlim,
+            'ylim': ylim,
+            'xticks': xticks,
+            'ylabel': ylabel}
+
+    return(spec)
+
+
+#-----------------------------------------------
+# Functions for drawing one figure from its spec (saved to spec['filename'])
+#-----------------------------------------------
+
+def _render_histogram(spec):
+
+    bins = spec['bins']
+
+    fig, ax = plt.subplots(figsize=(4,4))
+    ax.hist(bins[:-1], weights=spec['counts'] / max(spec['n_rows'], 1), bins=bins)
+    ax.annotate(spec['annotation'], xy = (125,200), xycoords = 'axes points')
+    ax.set_title(spec['title'])
+    ax.set_xlabel('Angle (deg)')
+    ax.set_xlim([0, 90])
+    ax.set_xticks(np.arange(0, 90, 10))
+    ax.yaxis.set_major_formatter(PercentFormatter(1))
+    ax.set_ylim([0, 1])
+
+    return(fig)
+
+
+def _render_timeseries(spec):
+
+    fig, ax = plt.subplots(figsize=(6,6))
+    for x, y, style in spec['lines']:
+        ax.plot(x, y, **style)
+
+    ax.set_title(spec['title'])
+    ax.set_xlabel('Date')
+    ax.set_xlim(spec['xlim'])
+    ax.xaxis.set_major_formatter(dates.DateFormatter('%d/%m/%Y'))
+    if spec['xticks'] is not None:
+        ax.set_xticks(spec['xticks'])
+
+    ax.set_ylabel(spec['ylabel'])
+    ax.set_ylim(spec['ylim'])
+
+    ax.legend(loc='upper right', prop={'size':12}, facecolor='white')
+    ax.axhline(y=0, xmin=0, xmax=1, linewidth =1, linestyle = '--', color='black')
+
+    return(fig)
+
+
+RENDERERS = {'histogram': _render_histogram,
+             'timeseries': _render_timeseries}
+
+
+def render_figure(spec):
+
+    fig = RENDERERS[spec['kind']](spec)
+
+    out_dir = os.path.dirname(spec['filename'])
+    if out_dir and not os.path.exists(out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+
+    fig.tight_layout()
+    fig.savefig(spec['filename'])
+    plt.close(fig)
+
+    return(spec['filename'])
+
+
+#-----------------------------------------------
+# Function for rendering a list of figure specs (in n_workers processes), returns the files written
+# With make_plots=False nothing is drawn (compute-only runs)
+#-----------------------------------------------
+
+def render_figures(specs, n_workers=1, make_plots=True):
+
+    if not make_plots or len(specs) == 0:
+        return([])
+
+    if n_workers == 1:
+        filenames = [render_figure(spec) for spec in specs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(specs))) as executor:
+            filenames = list(executor.map(render_figure, specs))
+
+    return(filenames)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+run_benchmarks.py
+
+Timings of the hot paths of the AMDAR/Mode-S processing, for comparing changes
+The processing steps are timed on a synthetic dataset (synthetic_metdb.py) and the results are appended
+to a CSV file, so timings can be compared over time
+
+To run the code:
+   ./run_benchmarks.py
+'''
+
+import datetime
+import os
+import subprocess
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from metdb_io import parse_metdb_time, import_metdb_file
+from geo_tools import calculate_orientation, build_airport_index, find_nearest_airports
+from runway_tools import build_runway_index
+from filter_amdar_data import import_amdar_files, segment_profiles, compare_orientation, add_operator
+from compare_modes_model import load_model_grid, extract_model_data
+from synthetic_metdb import generate_dataset
+
+
+#-----------------------------------------------
+# Function for timing a function (best of several repeats, in seconds)
+#-----------------------------------------------
+
+def time_function(function, repeat=5, number=1):
+
+    times = timeit.repeat(function, repeat=repeat, number=number)
+
+    return(min(times) / number)
+
+
+#-----------------------------------------------
+# Benchmark of the TIME parser against the previous string-based parsing
+#-----------------------------------------------
+
+def parse_time_strings(time_col):
+
+    time_col = time_col.astype(str) # convert time to string so '--' can be replaced
+
+    time_col = time_col.str.replace('--', '00') # replace null seconds with 00
+
+    return(pd.to_datetime(time_col, format='%Y%m%d%H%M%S'))
+
+
+def make_time_column(n_rows, null_seconds_fraction, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    start = np.datetime64('2022-01-01T00:00:00')
+    times = start + rng.integers(0, 31 * 86400, n_rows).astype('timedelta64[s]')
+    time_strings = pd.Series(times).dt.strftime('%Y%m%d%H%M%S')
+
+    if null_seconds_fraction == 0:
+        return(time_strings.astype(np.int64)) # read_csv gives integers when no seconds are missing
+
+    null_seconds = rng.random(n_rows) < null_seconds_fraction
+    time_strings[null_seconds] = time_strings[null_seconds].str[:12] + '--'
+
+    return(time_strings.astype(object))
+
+
+def benchmark_time_parser(n_rows=500000):
+
+    results = []
+
+    for null_seconds_fraction in [0, 0.1]:
+        time_col = make_time_column(n_rows, null_seconds_fraction)
+
+        assert (parse_time_strings(time_col).to_numpy() == parse_metdb_time(time_col)).all()
+
+        string_time = time_function(lambda: parse_time_strings(time_col))
+        integer_time = time_function(lambda: parse_metdb_time(time_col))
+
+        results.append({'benchmark': 'parse_time', 'rows': n_rows, 'null_seconds_fraction': null_seconds_fraction,
+                        'string_path_s': string_time, 'parse_metdb_time_s': integer_time, 'speedup': string_time / integer_time})
+
+    return(pd.DataFrame(results))
+
+
+#-----------------------------------------------
+# Benchmarks of the processing steps on a synthetic dataset (see synthetic_metdb.py)
+# One row per step: rows processed and best time (s)
+#-----------------------------------------------
+
+def benchmark_pipeline(dataset, repeat=5):
+
+    airport = dataset['airport_name_list'][0]
+    date = dataset['date_list'][0]
+    file_path = dataset['file_path']
+
+    results = []
+
+    def add_result(benchmark, rows, function):
+        results.append({'benchmark': benchmark, 'rows': rows, 'time_s': time_function(function, repeat)})
+
+    # Import (raw CSV, then from the cache)
+    data_amdar = import_amdar_files(file_path, 'AMDARS', airport, date)
+    data_modes = import_metdb_file(file_path, 'MODE-S', airport, date)
+
+    add_result('import_amdar_files', len(data_amdar), lambda: import_amdar_files(file_path, 'AMDARS', airport, date))
+    add_result('import_metdb_file MODE-S', len(data_modes), lambda: import_metdb_file(file_path, 'MODE-S', airport, date))
+
+    with tempfile.TemporaryDirectory() as cache_path:
+        import_metdb_file(file_path, 'MODE-S', airport, date, cache_path) # fill the cache
+        add_result('import_metdb_file MODE-S (cached)', len(data_modes), lambda: import_metdb_file(file_path, 'MODE-S', airport, date, cache_path))
+
+    # Segmentation into Ascents
+    add_result('segment_profiles', len(data_amdar), lambda: segment_profiles(data_amdar, 'Ascent', '10min'))
+    profiles = segment_profiles(data_amdar, 'Ascent', '10min')
+
+    # Orientation of all profiles
+    add_result('calculate_orientation', len(profiles), lambda: calculate_orientation(profiles.copy(), 'LAT', 'LON', group_col='profile_id'))
+
+    # Nearest airport (index built once, then one query for all Mode-S positions)
+    add_result('build_airport_index', len(dataset['airports']), lambda: build_airport_index(dataset['airports']))
+    airport_index = build_airport_index(dataset['airports'])
+    add_result('find_nearest_airports', len(data_modes), lambda: find_nearest_airports(airport_index, data_modes['LAT'], data_modes['LON']))
+
+    # Runway comparison and operators
+    runway_index = build_runway_index(dataset['runways'])
+    add_result('compare_orientation', len(profiles), lambda: compare_orientation(profiles, 'Ascent', 3, airport_index, runway_index))
+    _, summary_df = compare_orientation(profiles, 'Ascent', 3, airport_index, runway_index)
+    add_result('add_operator', len(summary_df), lambda: add_operator(summary_df.copy(), dataset['master_list']))
+
+    # Model values at many points (British Grid)
+    model_grid = load_model_grid(dataset['file_path_netcdf'], dataset['scenario_list'])
+    rng = np.random.default_rng(0)
+    point_lon = rng.uniform(0, 700000, len(data_modes))
+    point_lat = rng.uniform(0, 1250000, len(data_modes))
+    add_result('extract_model_data', len(data_modes), lambda: extract_model_data(model_grid, point_lon, point_lat, 1000, 1000))
+
+    return(pd.DataFrame(results))
+
+
+#-----------------------------------------------
+# Function for appending the results to a CSV file (with the run time and git commit, for comparison over time)
+#-----------------------------------------------
+
+def git_commit():
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+
+    return(commit)
+
+
+def write_results(results, results_file):
+
+    results_dir = os.path.dirname(results_file)
+    if results_dir and not os.path.exists(results_dir):
+        os.makedirs(results_dir, exist_ok=True)
+
+    results = results.assign(run_time=datetime.datetime.now().isoformat(timespec='seconds'), git_commit=git_commit())
+
+    if os.path.isfile(results_file) and list(pd.read_csv(results_file, nrows=0).columns) != list(results.columns):
+        previous = pd.read_csv(results_file) # columns changed since earlier runs - rewrite with the new header
+        columns = list(results.columns) + [column for column in previous.columns if column not in results.columns]
+        results = pd.concat([previous, results], ignore_index=True)[columns]
+        results.to_csv(results_file, index=False)
+    else:
+        results.to_csv(results_file, mode='a', header=not os.path.isfile(results_file), index=False)
+
+
+def main():
+
+    #---------------------------------------------------------------------
+    # 01. Settings
+    #---------------------------------------------------------------------
+
+    out_path = '/data/users/gdaron/Mode-S_altitude/benchmarks' # outside the repository, so results are never committed by accident
+    results_file = '{0}/benchmark_results.csv'.format(out_path) # results are appended, one block per run
+    data_path = None # folder to write the synthetic dataset to (None for a temporary folder)
+
+    repeat = 5 # best of n runs
+
+    #---------------------------------------------------------------------
+    # 02. Run the benchmarks
+    #---------------------------------------------------------------------
+
+    # TIME parser: one row for the previous string-based parsing and one for parse_metdb_time (with its speedup)
+    time_parser = benchmark_time_parser()
+    suffix = np.where(time_parser['null_seconds_fraction'] > 0, ' (-- seconds)', '')
+    results = [time_parser[['rows']].assign(benchmark='parse_time_strings' + suffix, time_s=time_parser['string_path_s']), \
+               time_parser[['rows', 'speedup']].assign(benchmark='parse_metdb_time' + suffix, time_s=time_parser['parse_metdb_time_s'])]
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        dataset = generate_dataset(data_path if data_path is not None else tmp_path, date_list=['20221122'])
+        results.append(benchmark_pipeline(dataset, repeat))
+
+    results = pd.concat(results, ignore_index=True)[['benchmark', 'rows', 'time_s', 'speedup']]
+
+    print(results.to_string(index=False))
+
+    write_results(results, results_file)
+
+
+if __name__ == '__main__':
+    main()
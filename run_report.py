@@ -0,0 +1,99 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+run_report.py
+
+Lightweight instrumentation for the processing scripts: wall time and counters (rows in/out, profiles,
+files read, ...) for each stage of a run, written to a JSON report at the end of the run, and the
+logging set-up used in place of print statements
+
+Usage (from another script):
+   from run_report import new_run_report, timed_stage, add_stage, merge_stages, write_run_report, setup_logging
+'''
+
+import datetime
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+
+#-----------------------------------------------
+# Function for setting up logging (log_level e.g. 'DEBUG' for per airport/date messages, 'INFO' or 'WARNING')
+#-----------------------------------------------
+
+def setup_logging(log_level='INFO'):
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s', level=log_level)
+
+
+#-----------------------------------------------
+# Functions for recording the stages of a run
+# report['stages'] maps a stage name to its totals (time_s, calls and any counters), summed over all calls
+#-----------------------------------------------
+
+def new_run_report(script, settings=None):
+
+    report = {'script': script,
+              'started': datetime.datetime.now().isoformat(timespec='seconds'),
+              'settings': {} if settings is None else settings,
+              'stages': {},
+              '_start_time': time.perf_counter()}
+
+    return(report)
+
+
+def add_stage(report, stage, **counters):
+
+    if report is None:
+        return
+
+    totals = report['stages'].setdefault(stage, {})
+    for name, value in counters.items():
+        totals[name] = totals.get(name, 0) + value
+
+
+@contextmanager
+def timed_stage(report, stage, **counters):
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(report, stage, time_s=time.perf_counter() - start, calls=1, **counters)
+
+
+#-----------------------------------------------
+# Function for adding the stages recorded in another process (e.g. a worker of a process pool) to a report
+#-----------------------------------------------
+
+def merge_stages(report, stages):
+
+    for stage, totals in stages.items():
+        add_stage(report, stage, **totals)
+
+
+#-----------------------------------------------
+# Function for writing the report (<out_path>/run_reports/<script>_<start time>.json), returns the filename
+#-----------------------------------------------
+
+def write_run_report(report, out_path):
+
+    report_path = os.path.join(out_path, 'run_reports')
+    if not os.path.exists(report_path):
+        os.makedirs(report_path)
+
+    output = {key: value for key, value in report.items() if not key.startswith('_')}
+    output['finished'] = datetime.datetime.now().isoformat(timespec='seconds')
+    output['total_time_s'] = time.perf_counter() - report['_start_time']
+
+    filename = os.path.join(report_path, '{0}_{1}.json'.format(report['script'], report['started'].replace(':', '').replace('-', '')))
+
+    with open(filename, 'w') as writer:
+        json.dump(output, writer, indent=1, default=str)
+
+    logging.getLogger(__name__).info('Run report written to %s', filename)
+
+    return(filename)
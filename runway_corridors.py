@@ -0,0 +1,195 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+runway_corridors.py
+
+Runway-aligned corridors around the study airports without ArcGIS (replaces the polygons of
+1.Create_runway_polygons.ipynb and the "WITHIN" selection of 2.Load_data_into_ArcGIS_Pro.ipynb): a line of
+2 x 25 km through the airport along the runway angle, buffered by 3 km, built with pyproj.Geod.fwd. The
+corridors are held in a spatial index (shapely STRtree if installed) and observations are tagged with a
+vectorized point-in-polygon test, so millions of points can be selected at once
+
+Usage (from another script):
+   from runway_corridors import build_corridor_index, tag_runway_area, select_runway_area
+'''
+
+import numpy as np
+import pandas as pd
+
+from geo_tools import GEODESIC
+
+# Airport locations and runway angles (deg) used for the corridors (as in 1.Create_runway_polygons.ipynb)
+AIRPORT_CORRIDORS = {'Heathrow': {'lat': 51.470022, 'lon': -0.454296, 'angle': 0},
+                     'Gatwick': {'lat': 51.153662, 'lon': -0.182063, 'angle': 8},
+                     'Manchester': {'lat': 53.358803, 'lon': -2.27273, 'angle': 25},
+                     'Stansted': {'lat': 51.886018, 'lon': 0.238866, 'angle': 34},
+                     'Edinburgh': {'lat': 55.950785, 'lon': -3.361453, 'angle': 19},
+                     'Birmingham': {'lat': 52.452382, 'lon': -1.743507, 'angle': 137},
+                     'Bristol': {'lat': 51.38363, 'lon': -2.713546, 'angle': 3},
+                     'Glasgow': {'lat': 55.869074, 'lon': -4.435053, 'angle': 28},
+                     'Aberdeen': {'lat': 57.203698, 'lon': -2.200162, 'angle': 127},
+                     'EastMidlands': {'lat': 52.829374, 'lon': -1.332134, 'angle': 0},
+                     'LondonCity': {'lat': 51.504844, 'lon': 0.049518, 'angle': -2},
+                     'BelfastInt': {'lat': 54.654173, 'lon': -6.224699, 'angle': 15},
+                     'Newcastle': {'lat': 55.038524, 'lon': -1.693079, 'angle': 14},
+                     'LeedsBradford': {'lat': 53.867943, 'lon': -1.661531, 'angle': -34},
+                     'Liverpool': {'lat': 53.336707, 'lon': -2.85744, 'angle': 3},
+                     'Cardiff': {'lat': 51.396667, 'lon': -3.343333, 'angle': -17}}
+
+CORRIDOR_HALF_LENGTH = 25000 # m, along the runway angle either side of the airport
+CORRIDOR_HALF_WIDTH = 3000 # m, buffer around the line (ends are rounded, as an ArcGIS buffer)
+
+
+#-----------------------------------------------
+# Function for building a corridor polygon: the line from the airport to +/- half_length along the angle,
+# buffered by half_width. Returns the lon/lat arrays of the ring (n_arc + 1 points on each rounded end)
+#-----------------------------------------------
+
+def build_corridor_polygon(lat, lon, angle, half_length=CORRIDOR_HALF_LENGTH, half_width=CORRIDOR_HALF_WIDTH, n_arc=16):
+
+    # ends of the line, and the direction of the line (away from the airport) at each end
+    end_lon, end_lat, back_azimuth = GEODESIC.fwd([lon, lon], [lat, lat], [angle, angle + 180], [half_length, half_length])
+    end_azimuth = np.asarray(back_azimuth) + 180
+
+    ring_lon = []
+    ring_lat = []
+    for i in range(2): # half circle around each end, from the left side of the line to its right side
+        azimuth = end_azimuth[i] + np.linspace(-90, 90, n_arc + 1)
+        arc_lon, arc_lat, _ = GEODESIC.fwd(np.full(n_arc + 1, end_lon[i]), np.full(n_arc + 1, end_lat[i]), azimuth, np.full(n_arc + 1, half_width))
+        ring_lon.append(arc_lon)
+        ring_lat.append(arc_lat)
+
+    return(np.concatenate(ring_lon), np.concatenate(ring_lat))
+
+
+#-----------------------------------------------
+# Function for building the corridor index (built once, queried for all observations)
+# corridor_index['lon']/['lat'] hold the rings of all corridors as (n_corridors, n_vertices) arrays
+#-----------------------------------------------
+
+def build_corridor_index(corridors=AIRPORT_CORRIDORS, half_length=CORRIDOR_HALF_LENGTH, half_width=CORRIDOR_HALF_WIDTH):
+
+    names = list(corridors)
+    rings = [build_corridor_polygon(corridors[name]['lat'], corridors[name]['lon'], corridors[name]['angle'], half_length, half_width) for name in names]
+
+    ring_lon = np.stack([ring[0] for ring in rings])
+    ring_lat = np.stack([ring[1] for ring in rings])
+
+    try:
+        import shapely
+        tree = shapely.STRtree(shapely.polygons(np.stack([ring_lon, ring_lat], axis=-1)))
+    except ImportError:
+        tree = None # fall back to checking the bounding box of every corridor
+
+    corridor_index = {'names': np.asarray(names, dtype=object),
+                      'lon': ring_lon,
+                      'lat': ring_lat,
+                      'bounds': np.column_stack([ring_lon.min(axis=1), ring_lat.min(axis=1), ring_lon.max(axis=1), ring_lat.max(axis=1)]),
+                      'tree': tree}
+
+    return(corridor_index)
+
+
+#-----------------------------------------------
+# Function for the (point, corridor) pairs to test: the points are binned into cells of cell_size degrees,
+# the index is queried once per occupied cell (not per point) and the pairs are then narrowed down to the
+# points within the bounding box of the corridor
+#-----------------------------------------------
+
+def _corridor_candidates(corridor_index, lat, lon, cell_size=0.05):
+
+    cell_x = np.floor(lon / cell_size).astype(np.int64)
+    cell_y = np.floor(lat / cell_size).astype(np.int64)
+    cells, point_cell = np.unique((cell_x + 2**20) * 2**21 + (cell_y + 2**20), return_inverse=True)
+    x0 = (cells // 2**21 - 2**20) * cell_size
+    y0 = (cells % 2**21 - 2**20) * cell_size
+
+    bounds = corridor_index['bounds']
+    if corridor_index['tree'] is not None:
+        import shapely
+        cell_ids, corridor_ids = corridor_index['tree'].query(shapely.box(x0, y0, x0 + cell_size, y0 + cell_size))
+    else:
+        overlap = (x0[:, None] <= bounds[:, 2]) & (x0[:, None] + cell_size >= bounds[:, 0]) & (y0[:, None] <= bounds[:, 3]) & (y0[:, None] + cell_size >= bounds[:, 1])
+        cell_ids, corridor_ids = np.nonzero(overlap)
+
+    # expand the (cell, corridor) pairs to the points of each cell
+    order = np.argsort(point_cell, kind='stable')
+    counts = np.bincount(point_cell, minlength=len(cells))
+    starts = np.cumsum(counts) - counts
+
+    pair_counts = counts[cell_ids]
+    pair = np.repeat(np.arange(len(cell_ids)), pair_counts)
+    offset = np.arange(len(pair)) - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts)
+    point_ids = order[starts[cell_ids[pair]] + offset]
+    corridor_ids = corridor_ids[pair]
+
+    box = bounds[corridor_ids]
+    in_box = (lon[point_ids] >= box[:, 0]) & (lat[point_ids] >= box[:, 1]) & (lon[point_ids] <= box[:, 2]) & (lat[point_ids] <= box[:, 3])
+
+    return(point_ids[in_box], corridor_ids[in_box])
+
+
+#-----------------------------------------------
+# Function for the point-in-polygon test of one ring and many points (crossing number, one vectorized step per
+# edge). Corridors are small enough for lon/lat to be treated as planar
+#-----------------------------------------------
+
+def _points_in_ring(ring_lon, ring_lat, lat, lon):
+
+    inside = np.zeros(len(lat), dtype=bool)
+
+    for x1, y1, x2, y2 in zip(ring_lon, ring_lat, np.roll(ring_lon, -1), np.roll(ring_lat, -1)):
+        if y1 == y2:
+            continue # horizontal edges are never crossed
+        crosses = (y1 > lat) != (y2 > lat)
+        inside ^= crosses & (lon < x1 + (lat - y1) * ((x2 - x1) / (y2 - y1)))
+
+    return(inside)
+
+
+#-----------------------------------------------
+# Function for tagging observations with the corridor they are in (name of the first matching corridor in the
+# index, None if outside all corridors or without a position)
+#-----------------------------------------------
+
+def tag_runway_area(corridor_index, lat, lon):
+
+    lat = np.atleast_1d(np.asarray(lat, dtype=float))
+    lon = np.atleast_1d(np.asarray(lon, dtype=float))
+
+    n_corridors = len(corridor_index['names'])
+    corridor = np.full(len(lat), n_corridors)
+
+    valid = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)))
+    point_ids, corridor_ids = _corridor_candidates(corridor_index, lat[valid], lon[valid])
+    point_ids = valid[point_ids]
+
+    for i in np.unique(corridor_ids):
+        candidates = point_ids[corridor_ids == i]
+        inside = _points_in_ring(corridor_index['lon'][i], corridor_index['lat'][i], lat[candidates], lon[candidates])
+        np.minimum.at(corridor, candidates[inside], i) # first corridor wins where corridors overlap
+
+    tags = np.append(corridor_index['names'], None)[corridor]
+
+    return(tags)
+
+
+#-----------------------------------------------
+# Function for selecting the observations within the runway corridor of an airport (or within any corridor
+# if airport is None) - the runway area subset of 2.Load_data_into_ArcGIS_Pro.ipynb
+#-----------------------------------------------
+
+def select_runway_area(df, corridor_index, airport=None, lat_col='LAT', lon_col='LON'):
+
+    if airport is not None: # only the corridor of this airport is tested
+        selected = corridor_index['names'] == airport
+        corridor_index = {'names': corridor_index['names'][selected],
+                          'lon': corridor_index['lon'][selected],
+                          'lat': corridor_index['lat'][selected],
+                          'bounds': corridor_index['bounds'][selected],
+                          'tree': None}
+
+    tags = tag_runway_area(corridor_index, df[lat_col].to_numpy(), df[lon_col].to_numpy())
+
+    return(df[pd.notna(tags)])
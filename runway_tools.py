@@ -0,0 +1,86 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+runway_tools.py
+
+Runway index built once from runways.csv (OurAirports layout): for each airport_ident, arrays of the runway
+headings, lengths and threshold coordinates, plus a table of the longest runway of every airport, so the
+runway orientation of many profiles can be looked up and compared in one vectorized step
+
+Usage (from another script):
+   from runway_tools import build_runway_index, longest_runway_headings, angle_difference
+'''
+
+import numpy as np
+import pandas as pd
+
+# runways.csv column -> name in the index (columns missing from the file are filled with NaN)
+RUNWAY_COLUMNS = {'he_heading_degT': 'he_heading',
+                  'le_heading_degT': 'le_heading',
+                  'length_ft': 'length_ft',
+                  'he_latitude_deg': 'he_lat',
+                  'he_longitude_deg': 'he_lon',
+                  'le_latitude_deg': 'le_lat',
+                  'le_longitude_deg': 'le_lon'}
+
+
+#-----------------------------------------------
+# Function for the reciprocal of a heading (he heading in [0, 180) -> +180, otherwise -180)
+#-----------------------------------------------
+
+def reciprocal_heading(heading):
+
+    heading = np.asarray(heading, dtype=float)
+
+    return(np.where((heading >= 0) & (heading < 180), heading + 180, heading - 180))
+
+
+#-----------------------------------------------
+# Function for building the runway index
+# runway_index['runways'][ident] holds the arrays of all runways of an airport (in file order)
+# runway_index['longest'] is indexed by ident, with the heading of the longest runway (first if tied)
+# and its reciprocal (le_heading, computed from the he heading)
+#-----------------------------------------------
+
+def build_runway_index(runway_info_df):
+
+    runways = pd.DataFrame({'airport_ident': runway_info_df['airport_ident'].to_numpy()})
+    for column, name in RUNWAY_COLUMNS.items():
+        runways[name] = runway_info_df[column].to_numpy(dtype=float) if column in runway_info_df.columns else np.nan
+
+    grouped = runways.groupby('airport_ident', sort=False)
+
+    runway_arrays = {ident: {name: group[name].to_numpy() for name in RUNWAY_COLUMNS.values()} for ident, group in grouped}
+
+    longest_rows = runways['length_ft'].fillna(-np.inf).groupby(runways['airport_ident'], sort=False).idxmax() # first row with the max length
+    longest = runways.loc[longest_rows.to_numpy()].set_index('airport_ident')
+    longest['le_heading'] = reciprocal_heading(longest['he_heading'])
+
+    runway_index = {'runways': runway_arrays,
+                    'longest': longest}
+
+    return(runway_index)
+
+
+#-----------------------------------------------
+# Function for the heading of the longest runway (and its reciprocal) for many airport idents at once
+# Returns two arrays (NaN for airports without a runway)
+#-----------------------------------------------
+
+def longest_runway_headings(runway_index, airport_ids):
+
+    longest = runway_index['longest'].reindex(np.asarray(airport_ids, dtype=object))
+
+    return(longest['he_heading'].to_numpy(), longest['le_heading'].to_numpy())
+
+
+#-----------------------------------------------
+# Function for the signed difference between two directions, in [-180, 180) degrees
+#-----------------------------------------------
+
+def angle_difference(orientation, heading):
+
+    difference = (np.asarray(orientation, dtype=float) - np.asarray(heading, dtype=float) + 180 + 360) % 360 - 180
+
+    return(difference)
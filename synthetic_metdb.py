@@ -0,0 +1,324 @@
+#!/usr/bin/env python3.8
+# -*- coding: iso-8859-1 -*-
+
+'''
+synthetic_metdb.py
+
+Generator of synthetic (but realistic) inputs for testing and benchmarking the processing:
+AMDARS and MODE-S airport-day extracts (in the MetDB_extract/<TYPE>/<airport>/<TYPE>_<date>.txt layout),
+airport and runway tables, an E-AMDAR master list and netCDF lowest beam height grids
+
+To run the code:
+   ./synthetic_metdb.py
+
+Usage (from another script):
+   from synthetic_metdb import generate_dataset
+'''
+
+import datetime
+import os
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from geo_tools import GEODESIC
+from metdb_io import metdb_filename
+
+
+#-----------------------------------------------
+# Function for a table of synthetic airports (in the layout of airports_GBonly_study.csv)
+# The first airports are placed at the study airports, the rest at random positions over the UK
+#-----------------------------------------------
+
+STUDY_AIRPORTS = [('EGLL', 'Heathrow', 51.4706, -0.4619),
+                  ('EGKK', 'Gatwick', 51.1481, -0.1903),
+                  ('EGCC', 'Manchester', 53.3537, -2.2750),
+                  ('EGSS', 'Stansted', 51.8850, 0.2350),
+                  ('EGPH', 'Edinburgh', 55.9500, -3.3725),
+                  ('EGBB', 'Birmingham', 52.4539, -1.7480),
+                  ('EGGD', 'Bristol', 51.3827, -2.7191),
+                  ('EGPF', 'Glasgow', 55.8719, -4.4331),
+                  ('EGPD', 'Aberdeen', 57.2019, -2.1978),
+                  ('EGNX', 'EastMidlands', 52.8311, -1.3281),
+                  ('EGLC', 'LondonCity', 51.5053, 0.0553),
+                  ('EGAA', 'BelfastInt', 54.6575, -6.2158),
+                  ('EGNT', 'Newcastle', 55.0375, -1.6917),
+                  ('EGNM', 'LeedsBradford', 53.8659, -1.6606),
+                  ('EGGP', 'Liverpool', 53.3336, -2.8497),
+                  ('EGFF', 'Cardiff', 51.3967, -3.3433)]
+
+
+def make_airports(n_airports=100, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    study = STUDY_AIRPORTS[:n_airports]
+    n_extra = n_airports - len(study)
+
+    airports = pd.DataFrame({'ident': [a[0] for a in study] + ['XG{0:04d}'.format(i) for i in range(n_extra)],
+                             'name': [a[1] for a in study] + ['Airfield{0:04d}'.format(i) for i in range(n_extra)],
+                             'latitude_deg': np.concatenate([[a[2] for a in study], rng.uniform(50.0, 58.5, n_extra)]),
+                             'longitude_deg': np.concatenate([[a[3] for a in study], rng.uniform(-6.5, 1.5, n_extra)])})
+
+    return(airports)
+
+
+#-----------------------------------------------
+# Function for a table of synthetic runways (in the layout of runways.csv, 1-3 runways per airport)
+#-----------------------------------------------
+
+def make_runways(airports, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    n_runways = rng.integers(1, 4, len(airports))
+    airport_ident = np.repeat(airports['ident'].to_numpy(), n_runways)
+
+    runways = pd.DataFrame({'airport_ident': airport_ident,
+                            'length_ft': rng.integers(10, 130, len(airport_ident)) * 100,
+                            'he_heading_degT': np.round(rng.uniform(0, 360, len(airport_ident)), 1)})
+
+    return(runways)
+
+
+#-----------------------------------------------
+# Function for a synthetic E-AMDAR master list (Identifier -> Operator ICAO), with some repeated identifiers
+#-----------------------------------------------
+
+def make_master_list(n_aircraft=2000, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    operators = np.array(['BAW', 'EZY', 'RYR', 'VIR', 'DLH', 'KLM', 'AFR', 'SHT', 'EXS', 'TOM'])
+
+    identifiers = np.array(['EU{0:04d}'.format(i) for i in range(n_aircraft)])
+    repeated = rng.choice(identifiers, n_aircraft // 20) # re-registered aircraft - the first match is used
+
+    master_list = pd.DataFrame({'Identifier': np.concatenate([identifiers, repeated]),
+                                'Operator ICAO': rng.choice(operators, n_aircraft + len(repeated))})
+
+    return(master_list)
+
+
+#-----------------------------------------------
+# Function for the positions of one flight near an airport (a straight climb-out along a runway heading)
+# Returns the points in time order: from the runway for an ascent, towards the runway for a descent
+#-----------------------------------------------
+
+def _flight_track(lat, lon, heading, n_points, interval, rng, ascent=True):
+
+    speed = rng.uniform(70, 90) # m/s
+    climb_rate = rng.uniform(6, 12) # m/s
+
+    elapsed = np.arange(n_points) * interval
+    distance = 500 + speed * elapsed
+    altitude = np.round(climb_rate * elapsed + rng.normal(0, 5, n_points))
+
+    track_lon, track_lat, _ = GEODESIC.fwd(np.full(n_points, lon), np.full(n_points, lat), np.full(n_points, heading), distance)
+    track_lat = track_lat + rng.normal(0, 2e-4, n_points) # position noise (~20 m)
+    track_lon = track_lon + rng.normal(0, 3e-4, n_points)
+
+    if not ascent: # approach along the reciprocal heading, flown in reverse
+        track_lat, track_lon, altitude = track_lat[::-1], track_lon[::-1], altitude[::-1]
+
+    return(track_lat, track_lon, altitude)
+
+
+#-----------------------------------------------
+# Function for formatting times as MetDB TIME values, with a fraction of the seconds missing ('--')
+#-----------------------------------------------
+
+def _metdb_times(times, rng, null_seconds_fraction):
+
+    time_strings = pd.Series(times).dt.strftime('%Y%m%d%H%M%S').to_numpy(dtype=object)
+
+    null_seconds = rng.random(len(time_strings)) < null_seconds_fraction
+    time_strings[null_seconds] = [value[:12] + '--' for value in time_strings[null_seconds]]
+
+    return(time_strings)
+
+
+#-----------------------------------------------
+# Functions for one synthetic airport-day of AMDARS (ascents, descents and some cruise points)
+# and MODE-S (many more aircraft and points) data, as read from the MetDB extract files
+# Each aircraft flies several flights per day, so profiles are separated by gaps in time
+#-----------------------------------------------
+
+def make_amdar_day(airport_row, runways, date, n_aircraft=20, flights_per_aircraft=4, points_per_flight=25,
+                   null_seconds_fraction=0.1, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    headings = runways.loc[runways['airport_ident'] == airport_row['ident'], 'he_heading_degT'].to_numpy()
+    if len(headings) == 0:
+        headings = np.array([0.0])
+
+    day_start = np.datetime64(pd.Timestamp(date), 's')
+    rows = []
+
+    for aircraft in rng.choice(2000, n_aircraft, replace=False):
+        departures = np.sort(rng.uniform(0, 86400 - 3600, flights_per_aircraft))
+
+        for flight, departure in enumerate(departures):
+            ascent = flight % 2 == 0
+            heading = rng.choice(headings) + (0 if ascent else 180)
+            interval = rng.choice([20, 30, 60])
+
+            lat, lon, altd = _flight_track(airport_row['latitude_deg'], airport_row['longitude_deg'], heading % 360,
+                                           points_per_flight, interval, rng, ascent)
+
+            phase = np.full(points_per_flight, 5 if ascent else 6)
+            phase[altd > 3000] = 3 # en-route
+
+            rows.append(pd.DataFrame({'RGSN_NMBR': "b'EU{0:04d}  '".format(aircraft),
+                                      'TIME': day_start + (departure + np.arange(points_per_flight) * interval).astype('timedelta64[s]'),
+                                      'LAT': lat,
+                                      'LON': lon,
+                                      'ALTD': altd.astype(int),
+                                      'FLGT_PHAS': phase}))
+
+    data = pd.concat(rows, ignore_index=True)
+    data = data.sample(frac=1, random_state=seed).reset_index(drop=True) # extracts are not sorted by aircraft
+    data['TIME'] = _metdb_times(data['TIME'], rng, null_seconds_fraction)
+
+    return(data)
+
+
+def make_modes_day(airport_row, date, n_aircraft=400, points_per_aircraft=250, null_seconds_fraction=0.1, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    n_rows = n_aircraft * points_per_aircraft
+    aircraft = np.repeat(rng.choice(2**24, n_aircraft, replace=False), points_per_aircraft)
+
+    day_start = np.datetime64(pd.Timestamp(date), 's')
+    times = day_start + rng.integers(0, 86400, n_rows).astype('timedelta64[s]')
+
+    distance = rng.uniform(0, 40000, n_rows)
+    azimuth = rng.uniform(0, 360, n_rows)
+    lon, lat, _ = GEODESIC.fwd(np.full(n_rows, airport_row['longitude_deg']), np.full(n_rows, airport_row['latitude_deg']), azimuth, distance)
+
+    pesr_altd = np.round(distance * rng.uniform(0.02, 0.08, n_rows) + rng.normal(0, 30, n_rows))
+    gnss_altd = pesr_altd + np.round(rng.normal(60, 40, n_rows))
+
+    data = pd.DataFrame({'AIRCRAFT_NO': ["b'{0:06X}'".format(value) for value in aircraft],
+                         'TIME': _metdb_times(times, rng, null_seconds_fraction),
+                         'LAT': lat,
+                         'LON': lon,
+                         'PESR_ALTD': pesr_altd.astype(int),
+                         'GNSS_ALTD': gnss_altd.astype(int)})
+
+    return(data)
+
+
+#-----------------------------------------------
+# Function for a synthetic lowest beam height grid (netCDF, British Grid axes, as read by compare_modes_model.py)
+# Heights increase away from a few radar sites, with missing values outside the coverage
+#-----------------------------------------------
+
+def write_beam_height_grid(filename, cellsize=1000, extent=(0, 0, 700000, 1250000), n_sites=12, seed=0):
+
+    import netCDF4 as nc
+
+    rng = np.random.default_rng(seed)
+
+    x = np.arange(extent[0], extent[2], cellsize) + cellsize / 2
+    y = np.arange(extent[1], extent[3], cellsize) + cellsize / 2
+
+    site_x = rng.uniform(extent[0], extent[2], n_sites)
+    site_y = rng.uniform(extent[1], extent[3], n_sites)
+
+    distance = np.full((len(y), len(x)), np.inf)
+    for sx, sy in zip(site_x, site_y):
+        distance = np.minimum(distance, np.hypot(x[np.newaxis, :] - sx, y[:, np.newaxis] - sy))
+
+    beam_height = (50 + distance**2 / (2 * 4 / 3 * 6371000)).astype(np.float32) # beam height over a curved earth
+    beam_height = np.ma.masked_where(distance > 250000, beam_height)
+
+    folder = os.path.dirname(filename)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    with nc.Dataset(filename, 'w') as ds:
+        ds.createDimension('latitude', len(y))
+        ds.createDimension('longitude', len(x))
+        ds.createVariable('latitude', 'f8', ('latitude',))[:] = y
+        ds.createVariable('longitude', 'f8', ('longitude',))[:] = x
+        ds.createVariable('lowest_beam_height_amsl', 'f4', ('latitude', 'longitude'), fill_value=-999.0)[:] = beam_height
+
+
+#-----------------------------------------------
+# Function for writing a complete synthetic dataset below root_path:
+#   MetDB_extract/<TYPE>/<airport>/<TYPE>_<date>.txt, AirportInfo/ (airports, runways, master list),
+#   Min_obs_altd/constant_ng_network_<scenario>_deriv.nc
+# Returns a dict with the paths and the tables that were written
+#-----------------------------------------------
+
+def generate_dataset(root_path, airport_name_list=None, date_list=None, n_airports=100, amdar_aircraft=20,
+                     modes_aircraft=400, scenario_list=('Existing', 'Priority', 'AllSites'), seed=0):
+
+    airports = make_airports(n_airports, seed)
+    runways = make_runways(airports, seed)
+    master_list = make_master_list(seed=seed)
+
+    if airport_name_list is None:
+        airport_name_list = [a[1] for a in STUDY_AIRPORTS[:2]]
+    if date_list is None:
+        date_list = ['20221122', '20221123']
+
+    file_path = os.path.join(root_path, 'MetDB_extract')
+    file_path_info = os.path.join(root_path, 'AirportInfo')
+    file_path_netcdf = os.path.join(root_path, 'Min_obs_altd')
+
+    for i, airport in enumerate(airport_name_list):
+        airport_row = airports.loc[airports['name'] == airport].iloc[0]
+
+        for j, date in enumerate(date_list):
+            day_seed = seed + 1000 * i + j
+            for data_type, data in [('AMDARS', make_amdar_day(airport_row, runways, date, amdar_aircraft, seed=day_seed)),
+                                    ('MODE-S', make_modes_day(airport_row, date, modes_aircraft, seed=day_seed))]:
+                filename = metdb_filename(file_path, data_type, airport, date)
+                if not os.path.exists(os.path.dirname(filename)):
+                    os.makedirs(os.path.dirname(filename))
+                data.to_csv(filename, index=False)
+
+    if not os.path.exists(file_path_info):
+        os.makedirs(file_path_info)
+
+    airports.to_csv(os.path.join(file_path_info, 'airports_GBonly_study.csv'), index=False)
+    runways.to_csv(os.path.join(file_path_info, 'runways.csv'), index=False)
+    try:
+        master_list.to_excel(os.path.join(file_path_info, 'E-AMDAR Master List Dec 2021.xlsx'), sheet_name='MASTER', index=False)
+    except ImportError:
+        pass # no Excel writer (openpyxl) installed - the master list is still returned
+
+    for i, scenario in enumerate(scenario_list):
+        write_beam_height_grid(os.path.join(file_path_netcdf, 'constant_ng_network_{0}_deriv.nc'.format(scenario)), n_sites=6 * (i + 1), seed=seed)
+
+    dataset = {'file_path': file_path,
+               'file_path_info': file_path_info,
+               'file_path_netcdf': file_path_netcdf,
+               'airport_name_list': list(airport_name_list),
+               'date_list': list(date_list),
+               'scenario_list': list(scenario_list),
+               'airports': airports,
+               'runways': runways,
+               'master_list': master_list}
+
+    return(dataset)
+
+
+if __name__ == '__main__':
+
+    root_path = '/data/users/gdaron/Mode-S_altitude/synthetic'
+
+    start_date = datetime.date(2022,1,1)
+    end_date = datetime.date(2022,1,7)
+
+    date_list = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    date_list = [date_obj.strftime('%Y%m%d') for date_obj in date_list]
+
+    airport_name_list = [a[1] for a in STUDY_AIRPORTS]
+
+    generate_dataset(root_path, airport_name_list, date_list)
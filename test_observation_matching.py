@@ -0,0 +1,89 @@
+# -*- coding: iso-8859-1 -*-
+
+'''
+test_observation_matching.py
+
+Checks of the AMDAR/Mode-S report matching on synthetic tracks with a known altitude bias
+
+To run the tests:
+   python -m pytest test_observation_matching.py
+'''
+
+import numpy as np
+import pandas as pd
+
+from observation_matching import match_observations, altitude_bias
+
+ALTITUDE_BIAS = 20 # m, Mode-S pressure altitude - AMDAR altitude
+
+
+#-----------------------------------------------
+# Synthetic reports: aircraft climbing out on parallel tracks (20 km apart), a Mode-S report every 4 s,
+# and an AMDAR report from the same aircraft every 60 s, up to 1 s after a Mode-S report
+#-----------------------------------------------
+
+def synthetic_reports(n_aircraft=5, n_modes=600, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    modes_frames = []
+    amdar_frames = []
+    for i in range(n_aircraft):
+
+        time = pd.Timestamp('2022-01-01 06:00:00') + pd.to_timedelta(np.arange(n_modes) * 4 + i * 7, unit='s')
+        lat = 51.0 + np.arange(n_modes) * 0.004 # ~450 m between reports
+        lon = np.full(n_modes, -1.0 + 0.3 * i)
+        altd = 100 + np.arange(n_modes) * 10
+
+        modes_frames.append(pd.DataFrame({'AIRCRAFT_NO': '40{0:04X}'.format(i), 'LAT': lat, 'LON': lon, 'PESR_ALTD': altd}, index=pd.Index(time, name='TIME')))
+
+        rows = np.arange(0, n_modes, 15)
+        amdar_time = time[rows] + pd.to_timedelta(rng.integers(0, 2, len(rows)), unit='s')
+        amdar_frames.append(pd.DataFrame({'RGSN_NMBR': 'EU{0:04d}'.format(i), 'LAT': lat[rows], 'LON': lon[rows], 'ALTD': altd[rows] - ALTITUDE_BIAS}, \
+                                         index=pd.Index(amdar_time, name='TIME')))
+
+    return(pd.concat(amdar_frames).sort_index(), pd.concat(modes_frames).sort_index())
+
+
+def test_nearest_matches_recover_bias():
+
+    amdar, modes = synthetic_reports()
+
+    # reports that can't be matched: far from every track, and an hour after the last Mode-S report
+    unmatched = pd.DataFrame({'RGSN_NMBR': 'EU9999', 'LAT': [55.0, 51.0], 'LON': [-1.0, -1.0], 'ALTD': [500, 500]}, \
+                             index=pd.Index([amdar.index[0], modes.index[-1] + pd.Timedelta('1h')], name='TIME'))
+    amdar = pd.concat([amdar, unmatched]).sort_index()
+
+    matches = match_observations(amdar, modes, time_tolerance='10s', max_distance=1000)
+
+    assert len(matches) == len(amdar) - len(unmatched)
+    assert (matches['match'] == 'nearest').all()
+    assert (matches['distance'] < 1).all() # the report at the AMDAR position is chosen, not its neighbours along the track
+    assert (matches['time_diff'].abs() <= 10).all()
+    assert (matches['RGSN_NMBR'].str[-1] == matches['AIRCRAFT_NO'].str[-1]).all()
+
+    bias = altitude_bias(matches)
+    assert bias['count'] == len(matches)
+    assert np.isclose(bias['mean'], ALTITUDE_BIAS) and bias['std'] == 0
+
+
+def test_identity_matches():
+
+    amdar, modes = synthetic_reports()
+    amdar['LAT'] += 0.005 # ~550 m from the Mode-S report, closer to the next one along the track
+
+    id_links = pd.DataFrame({'RGSN_NMBR': ['EU0000', 'EU0001'], 'AIRCRAFT_NO': ['400000', '400001']})
+
+    matches = match_observations(amdar, modes, time_tolerance='10s', max_distance=1000, id_links=id_links)
+
+    identity = matches[matches['match'] == 'identity']
+    assert len(matches) == len(amdar)
+    assert len(identity) == (amdar['RGSN_NMBR'].isin(id_links['RGSN_NMBR'])).sum()
+
+    # identity matches take the nearest report in time, so the injected bias is recovered exactly
+    assert np.allclose(identity['altd_diff'], ALTITUDE_BIAS)
+    assert (identity['time_diff'].abs() <= 1).all()
+
+    bias = altitude_bias(matches, by='match')
+    assert bias.loc['identity', 'count'] == len(identity)
+    assert bias.loc['nearest', 'mean'] > ALTITUDE_BIAS # matched by position to the next (higher) report
@@ -0,0 +1,88 @@
+# -*- coding: iso-8859-1 -*-
+
+'''
+test_runway_corridors.py
+
+Checks of the runway corridor tagging against shapely (point-in-polygon of the same rings)
+
+To run the tests:
+   python -m pytest test_runway_corridors.py
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from runway_corridors import AIRPORT_CORRIDORS, build_corridor_index, tag_runway_area, select_runway_area
+
+shapely = pytest.importorskip('shapely')
+
+
+#-----------------------------------------------
+# Random points around the airports (most within 40 km, so both sides of every corridor edge are tested)
+#-----------------------------------------------
+
+def random_points(n_points=200000, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    airports = list(AIRPORT_CORRIDORS.values())
+    centre = rng.integers(0, len(airports), n_points)
+    lat = np.array([airport['lat'] for airport in airports])[centre] + rng.uniform(-0.4, 0.4, n_points)
+    lon = np.array([airport['lon'] for airport in airports])[centre] + rng.uniform(-0.6, 0.6, n_points)
+
+    return(lat, lon)
+
+
+def shapely_tags(corridor_index, lat, lon):
+
+    tags = np.full(len(lat), None, dtype=object)
+
+    for i in range(len(corridor_index['names']) - 1, -1, -1): # first corridor wins where corridors overlap
+        polygon = shapely.Polygon(np.column_stack([corridor_index['lon'][i], corridor_index['lat'][i]]))
+        tags[shapely.contains_xy(polygon, lon, lat)] = corridor_index['names'][i]
+
+    return(tags)
+
+
+@pytest.mark.parametrize('use_tree', [True, False])
+def test_tags_match_shapely(use_tree):
+
+    corridor_index = build_corridor_index()
+    if not use_tree:
+        corridor_index['tree'] = None # bounding box fallback (no shapely)
+
+    lat, lon = random_points()
+    tags = tag_runway_area(corridor_index, lat, lon)
+    expected = shapely_tags(corridor_index, lat, lon)
+
+    assert (tags == expected).all()
+    assert pd.notna(tags).sum() > 10000 # the points cover the corridors, not only the space around them
+
+
+def test_corridor_size():
+
+    corridor_index = build_corridor_index()
+    airport = AIRPORT_CORRIDORS['Heathrow'] # runway angle 0: the corridor runs north-south
+
+    # 2 x (25 + 3) km along the runway, 2 x 3 km across it (1 deg of latitude is ~111 km)
+    lat = airport['lat'] + np.array([0.24, 0.26, 0, 0])
+    lon = airport['lon'] + np.array([0, 0, 0.04, 0.05])
+    assert (tag_runway_area(corridor_index, lat, lon) == np.array(['Heathrow', None, 'Heathrow', None], dtype=object)).all()
+
+
+def test_select_runway_area():
+
+    corridor_index = build_corridor_index()
+
+    lat, lon = random_points(20000, seed=1)
+    lat[:10] = np.nan # observations without a position are never selected
+    df = pd.DataFrame({'LAT': lat, 'LON': lon})
+
+    selected = select_runway_area(df, corridor_index, airport='Gatwick')
+    expected = shapely_tags(corridor_index, lat, lon)
+
+    polygon = shapely.Polygon(np.column_stack([corridor_index['lon'][1], corridor_index['lat'][1]]))
+    assert selected.index.equals(df.index[shapely.contains_xy(polygon, lon, lat)])
+    assert len(selected) > 0
+    assert len(select_runway_area(df, corridor_index)) == pd.notna(expected).sum()
@@ -13,6 +13,7 @@ Author: gdaron
 '''
 
 import csv
+import logging
 import pandas as pd
 import numpy as np
 import os
@@ -21,25 +22,36 @@ from matplotlib import dates
 import datetime
 from datetime import timedelta
 
+from runway_corridors import build_corridor_index, select_runway_area as select_corridor_rows
+from observation_store import import_store_day, store_filename
+from metdb_io import import_metdb_file, metdb_filename, concat_metdb_frames, iter_metdb_chunks, LOADER_VERSION
+from altitude_stats import new_daily_accumulator, update_daily_accumulator, daily_accumulator_results
+from incremental import load_manifest, save_manifest, result_signature, is_up_to_date, load_result, save_result
+from plotting import timeseries_spec, render_figures
+from run_report import new_run_report, timed_stage, add_stage, write_run_report, setup_logging
 
-def import_files(file_path, data_type, airport, date):
+logger = logging.getLogger('visualise_altitude')
 
-    filename = '{0}/{1}/{2}/{1}_{3}.txt'.format(file_path, data_type, airport, date) 
 
-    if not os.path.isfile(filename):
-        return -1
+def import_files(file_path, data_type, airport, date, cache_path=None):
 
-    data = pd.read_csv(filename)
+    data = import_metdb_file(file_path, data_type, airport, date, cache_path) # parsed data is cached if cache_path is set
 
-    data['TIME'] = data['TIME'].astype(str) # convert time to string so '--' can be replaced
+    return(data)
 
-    data['TIME'] = data['TIME'].str.replace('--', '00') # replace null seconds with 00   
 
-    data['TIME'] = pd.to_datetime(data['TIME'], format='%Y%m%d%H%M%S')
+#-----------------------------------------------
+# Function for concatenating the daily mins of one data type (empty, with a day index, if there are none)
+#-----------------------------------------------
 
-    data.set_index('TIME', inplace=True)
+def concat_day_min(frames, column):
 
-    return(data)
+    frames = [frame for frame in frames if frame is not None] # None where a data type had no file
+
+    if len(frames) == 0:
+        return(pd.DataFrame({column: pd.Series(dtype=float)}, index=pd.DatetimeIndex([], name='TIME')))
+
+    return(pd.concat(frames).sort_index(kind='mergesort'))
 
 
 def main():
@@ -50,6 +62,12 @@ def main():
 
     file_path = '/data/users/gdaron/Mode-S_altitude/MetDB_extract/'
     out_path = '/data/users/gdaron/Mode-S_altitude/Mode-S_vs_AMDAR'
+    cache_path = '/data/users/gdaron/Mode-S_altitude/MetDB_cache' # Parquet cache of parsed extracts (set to None to always read the raw files)
+    incremental_path = out_path+'/incremental' # daily mins are reused while the extract files are unchanged (set to None to always recompute)
+    store_path = None # partitioned observation store built by observation_store.py, None to read the extract files
+    stream_chunksize = None # None to load whole days through the cache, or a row count to stream the raw extracts in chunks (bypasses the cache)
+    select_runway_area = False # True to keep only the observations within the runway corridor of each airport (runway_corridors.py)
+    keep_raw_rows = False # True to also keep every row in memory (only needed for the whole-period plot, which is switched off)
 
     if not os.path.exists(out_path):
         os.makedirs(out_path)
@@ -91,57 +109,128 @@ def main():
     y_max = 3000 # useful if all plots have the same axis ranges
     y_min = -250 
 
+    make_plots = True # False for compute-only runs (no figures are drawn)
+    n_plot_workers = 4 # number of processes used for drawing the figures
+
+    log_level = 'INFO' # 'DEBUG' to log every airport/date, 'WARNING' for errors/warnings only
+
+    setup_logging(log_level)
+
+    report = new_run_report('visualise_altitude', {'period': period, 'airports': airport_name_list})
+
     #---------------------------------------------------------------------    
     # 02. Loop through airports/dates and plot altitude
     #---------------------------------------------------------------------
 
-    diff_df = pd.DataFrame()
+    diff_rows = [] # one row per airport, converted to a dataframe at the end
+    figure_specs = [] # daily minimum plot of each airport
 
-    for airport in airport_name_list:
+    out_path_day_min = out_path+'/daily_min'
 
-    	concat_amdar = pd.DataFrame()
-    	concat_modes = pd.DataFrame()
-    	concat_amdar_day_min = pd.DataFrame()
-    	concat_modes_day_min = pd.DataFrame()
+    if not os.path.exists(out_path_day_min):
+        os.makedirs(out_path_day_min)
 
-    	for date in date_list:
+    if incremental_path is not None:
+    	manifest = load_manifest(incremental_path)
+    	params = {'amdar_altd': 'ALTD', 'modes_altd': 'PESR_ALTD', 'n_lowest': 1, 'loader_version': LOADER_VERSION, 'select_runway_area': select_runway_area}
 
-    		print('Loading data for: {0} {1}'.format(airport, date))
+    corridor_index = build_corridor_index() if select_runway_area else None
 
-    		data_amdar = import_files(file_path, 'AMDARS', airport, date)
-    		data_modes = import_files(file_path, 'MODE-S', airport, date)
+    for airport in airport_name_list:
 
-    		# Find row containing daily min
-    		data_amdar_day_min = data_amdar[data_amdar.ALTD==data_amdar.ALTD.min()]
-    		data_modes_day_min = data_modes[data_modes.PESR_ALTD==data_modes.PESR_ALTD.min()]
+    	# running daily minimum accumulators (one row per day in memory); raw rows are only kept if keep_raw_rows is set
+    	amdar_accumulator = new_daily_accumulator('ALTD')
+    	modes_accumulator = new_daily_accumulator('PESR_ALTD')
+    	amdar_frames = []
+    	modes_frames = []
+    	amdar_day_min_frames = []
+    	modes_day_min_frames = []
 
-    		concat_amdar = pd.concat([concat_amdar, data_amdar])
-    		concat_modes = pd.concat([concat_modes, data_modes])
+    	loaded = [] # (key, signature, day) of the days loaded in this run (incremental mode)
 
-    		concat_amdar_day_min = pd.concat([concat_amdar_day_min, data_amdar_day_min])
-    		concat_modes_day_min = pd.concat([concat_modes_day_min, data_modes_day_min])
+    	for date in date_list:
 
-    	# Create dataframe of daily minimum AMDAR and Mode-S altitudes 
-    	concat_amdar_day_min.reset_index(inplace=True)         
-    	concat_amdar_day_min['TIME'] = concat_amdar_day_min['TIME'].dt.strftime('%Y%m%d')    
-    	concat_amdar_day_min = concat_amdar_day_min.drop_duplicates(['TIME'], keep='first')    	
+    		# Incremental mode: reuse the daily mins if the AMDAR and Mode-S files for this day are unchanged
+    		# (the full data is then not loaded - it is only used by the whole-period plot, which is switched off)
+    		if incremental_path is not None:
+    			key = '{0}_{1}'.format(airport, date)
+    			if store_path is not None:
+    				input_files = [store_filename(store_path, 'AMDARS', airport, date), store_filename(store_path, 'MODE-S', airport, date)]
+    			else:
+    				input_files = [metdb_filename(file_path, 'AMDARS', airport, date), metdb_filename(file_path, 'MODE-S', airport, date)]
+    			signature = result_signature(manifest, input_files, params)
+    			if is_up_to_date(manifest, incremental_path, key, signature):
+    				data_amdar_day_min, data_modes_day_min = load_result(incremental_path, key) # None for a data type without a file
+    				amdar_day_min_frames.append(data_amdar_day_min)
+    				modes_day_min_frames.append(data_modes_day_min)
+    				add_stage(report, 'incremental', results_reused=1)
+    				continue
+    			loaded.append((key, signature, pd.Timestamp(date)))
+
+    		logger.debug('Loading data for: %s %s', airport, date)
+
+    		# Update the daily mins with each day (from the store, whole files, or chunks of stream_chunksize rows)
+    		with timed_stage(report, 'load'):
+    			for data_type, accumulator, frames in [('AMDARS', amdar_accumulator, amdar_frames), ('MODE-S', modes_accumulator, modes_frames)]:
+    				file_read = False
+    				if store_path is not None:
+    					chunks = [import_store_day(store_path, data_type, airport, date)]
+    				elif stream_chunksize is None:
+    					chunks = [import_files(file_path, data_type, airport, date, cache_path)]
+    				else:
+    					chunks = iter_metdb_chunks(metdb_filename(file_path, data_type, airport, date), data_type, stream_chunksize)
+
+    				for chunk in chunks:
+    					if type(chunk) == int: # no file for this airport/date
+    						continue
+    					file_read = True
+    					if select_runway_area:
+    						chunk = select_corridor_rows(chunk, corridor_index, airport)
+    					update_daily_accumulator(accumulator, chunk)
+    					if keep_raw_rows:
+    						frames.append(chunk)
+
+    				if file_read: # missing files are not counted
+    					add_stage(report, 'load', files_read=1)
+
+    	# Rows containing the daily mins of the loaded days (indexed by day)
+    	data_amdar_day_min, amdar_summary = daily_accumulator_results(amdar_accumulator)
+    	data_modes_day_min, modes_summary = daily_accumulator_results(modes_accumulator)
+    	add_stage(report, 'load', rows_out=amdar_accumulator['n_rows'] + modes_accumulator['n_rows'])
+
+    	if keep_raw_rows and len(amdar_frames) > 0: # only needed for the whole-period plot
+    		concat_amdar = concat_metdb_frames(amdar_frames)
+    		concat_modes = concat_metdb_frames(modes_frames)
+
+    	# Each data type is kept on its own (one of them may have no files for the loaded days)
+    	amdar_day_min_frames.append(data_amdar_day_min)
+    	modes_day_min_frames.append(data_modes_day_min)
+
+    	for key, signature, day in loaded:
+    		save_result(manifest, incremental_path, key, signature, \
+                            tuple(None if day_min is None else day_min[day_min.index == day] for day_min in [data_amdar_day_min, data_modes_day_min]))
+
+    	if incremental_path is not None:
+    		save_manifest(manifest, incremental_path)
 
-    	concat_modes_day_min.reset_index(inplace=True)         
-    	concat_modes_day_min['TIME'] = concat_modes_day_min['TIME'].dt.strftime('%Y%m%d')    
-    	concat_modes_day_min = concat_modes_day_min.drop_duplicates(['TIME'], keep='first')
+    	# Create dataframe of daily minimum AMDAR and Mode-S altitudes 
+    	concat_amdar_day_min = concat_day_min(amdar_day_min_frames, 'ALTD')
+    	concat_modes_day_min = concat_day_min(modes_day_min_frames, 'PESR_ALTD')
 
-    	concat_amdar_day_min['TIME'] = pd.to_datetime(concat_amdar_day_min['TIME'], format='%Y%m%d')
-    	concat_modes_day_min['TIME'] = pd.to_datetime(concat_modes_day_min['TIME'], format='%Y%m%d')
+    	if len(concat_amdar_day_min) == 0 and len(concat_modes_day_min) == 0: # no data at all - the airport is listed with NaNs
+    		logger.warning('No AMDAR or Mode-S data for %s %s-%s', airport, date_list[0], date_list[-1])
+    		diff_rows.append([airport, np.nan, np.nan, np.nan])
+    		continue
 
-    	concat_amdar_day_min.set_index('TIME', inplace=True)
-    	concat_modes_day_min.set_index('TIME', inplace=True)
+    	for data_type, day_min in [('AMDAR', concat_amdar_day_min), ('Mode-S', concat_modes_day_min)]:
+    		if len(day_min) == 0:
+    			logger.warning('No %s data for %s %s-%s', data_type, airport, date_list[0], date_list[-1])
 
-    	diff = concat_modes_day_min['PESR_ALTD'] - concat_amdar_day_min['ALTD']
+    	diff = concat_modes_day_min['PESR_ALTD'] - concat_amdar_day_min['ALTD'] # paired by day (index alignment), NaN on days with one data type only
     	mean_diff = diff.mean(axis=0)
     	mean_min_amdar_altd = concat_amdar_day_min['ALTD'].mean(axis=0)
     	mean_min_modes_altd = concat_modes_day_min['PESR_ALTD'].mean(axis=0)
-    	series = pd.Series([airport, mean_diff, mean_min_amdar_altd, mean_min_modes_altd])
-    	diff_df = pd.concat([diff_df, series], axis=1)
+    	diff_rows.append([airport, mean_diff, mean_min_amdar_altd, mean_min_modes_altd])
         	
     	# Plot data (multiple days)
     	'''
@@ -176,40 +265,22 @@ def main():
     	plt.close(fig2)
     	'''
 
-    	# Plot daily minimun altitude data 
-  
-    	fig3, ax3 = plt.subplots(figsize=(6,6))
-    	plt.plot(concat_modes_day_min['PESR_ALTD'], marker='.', color ='#1f77b4', linestyle='-', label='Mode-S pressure altitude (daily min)')
-    	plt.plot(concat_amdar_day_min['ALTD'], marker='.', color='#d62728', linestyle='-', label='AMDAR pressure altitude (daily min)')
-
-    	#ax3.set_title('{0} airport (daily min altd) '.format(airport)+str(start_date_reformat)+' to '+str(end_date_reformat))
-    	ax3.set_title('{0} airport - {1}'.format(airport, period))
+    	# Plot daily minimun altitude data (figure specs are collected and drawn after the loop)
+    	figure_specs.append(timeseries_spec(os.path.join(out_path_day_min, '{0}_day_min_altd_{1}.jpg'.format(airport, period)), \
+                                            [(concat_modes_day_min['PESR_ALTD'], {'marker': '.', 'color': '#1f77b4', 'linestyle': '-', 'label': 'Mode-S pressure altitude (daily min)'}), \
+                                             (concat_amdar_day_min['ALTD'], {'marker': '.', 'color': '#d62728', 'linestyle': '-', 'label': 'AMDAR pressure altitude (daily min)'})], \
+                                            '{0} airport - {1}'.format(airport, period), [start_date, end_date], [y_min, y_max], \
+                                            np.arange(start_date, end_date, 7)))
 
-    	ax3.set_xlabel('Date')
-    	ax3.set_xlim([start_date, end_date])
-    	ax3.xaxis.set_major_formatter(dates.DateFormatter('%d/%m/%Y'))
-    	ax3.set_xticks(np.arange(start_date, end_date, 7))
-
-    	ax3.set_ylabel('Altitude / m')
-    	ax3.set_ylim([y_min, y_max])
-
-    	plt.legend(loc='upper right', prop={'size':12}, facecolor='white')
-    	ax3.axhline(y=0, xmin=0, xmax=1, linewidth =1, linestyle = '--', color='black')
-    	plt.tight_layout()
-
-    	out_path_day_min = out_path+'/daily_min'
-
-    	if not os.path.exists(out_path_day_min):
-        	os.makedirs(out_path_day_min)
-
-    	plt.savefig(os.path.join(out_path_day_min, '{0}_day_min_altd_{1}.jpg'.format(airport, period)))
-    	#plt.show() 
-    	plt.close(fig3)
+    # Draw the daily minimum plots of all airports (in n_plot_workers processes)
+    with timed_stage(report, 'plotting', figures=len(figure_specs) if make_plots else 0):
+        render_figures(figure_specs, n_plot_workers, make_plots)
 
+    diff_df = pd.DataFrame(diff_rows, columns = ['Airport', 'Mode-S (mean daily min) - AMDAR (mean daily min)', 'AMDAR (mean daily min)', 'Mode-S (mean daily min)'])
+    with timed_stage(report, 'export', rows_out=len(diff_df)):
+        diff_df.to_csv(os.path.join(out_path_day_min, 'Mode-S-AMDAR_daily_mins_{0}.csv'.format(period)), index=False)
 
-    diff_df = diff_df.transpose()
-    diff_df.columns = ['Airport', 'Mode-S (mean daily min) - AMDAR (mean daily min)', 'AMDAR (mean daily min)', 'Mode-S (mean daily min)']
-    diff_df.to_csv(os.path.join(out_path_day_min, 'Mode-S-AMDAR_daily_mins_{0}.csv'.format(period)), index=False)
+    write_run_report(report, out_path)
 
 
 if __name__ == '__main__':